@@ -4,56 +4,66 @@ import subprocess
 import json
 import os
 import re
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Dict
 
-import yaml
+from aur import AUR
+from config_index import ConfigIndex
+from history import History
+from log_classifier import classify, read_run_log
+
+RUN_LOG_WORKERS = 8
+# 只分析最近一次 check-update 之后的构建，同步最近几天的运行就够了
+SYNC_DAYS = 7
 
 def run_gh_command(args: List[str]) -> str:
     result = subprocess.run(['gh'] + args, capture_output=True, text=True, check=True)
     return result.stdout
 
-def get_check_update_time() -> tuple[datetime, str]:
+def get_run_infos(run_ids: List[str], history: History = None) -> Dict[str, dict]:
+    """优先使用本地历史库中的结果，其余的用有界线程池并发获取"""
+    run_ids = list(dict.fromkeys(run_ids))
+    infos = {}
+    if history is not None:
+        for run_id in run_ids:
+            info = history.run_info(run_id)
+            if info is not None:
+                infos[run_id] = info
+    missing = [run_id for run_id in run_ids if run_id not in infos]
+    with ThreadPoolExecutor(max_workers=RUN_LOG_WORKERS) as executor:
+        infos.update(zip(missing, executor.map(get_run_info, missing)))
+    return infos
+
+def get_check_update_time(history: History) -> tuple[datetime, str]:
     print("🔍 Getting last check update action time...")
-    try:
-        output = run_gh_command(['run', 'list', '--workflow=check-update.yml', '--limit=1', '--json=databaseId,createdAt'])
-        runs = json.loads(output)
-        if not runs:
-            raise Exception("No check-update workflow runs found")
-        run = runs[0]
-        run_id = run['databaseId']
-        created_at = run['createdAt']
-        check_time = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-        print(f"   Last check update time: {check_time.isoformat()} (run_id: {run_id})")
-        return check_time, run_id
-    except subprocess.CalledProcessError as e:
-        print(f"  gh command failed: {e.stderr}")
-        raise
-    except Exception as e:
-        print(f"  Error: {e}")
-        raise
-
-def get_build_test_runs_since(check_time: datetime) -> List[Dict]:
+    run = history.latest_run('check-update.yml')
+    if run is None:
+        raise Exception("No check-update workflow runs found")
+    run_id = run['run_id']
+    check_time = datetime.fromisoformat(run['created_at'].replace('Z', '+00:00'))
+    print(f"   Last check update time: {check_time.isoformat()} (run_id: {run_id})")
+    return check_time, run_id
+
+def get_build_test_runs_since(history: History, check_time: datetime) -> List[Dict]:
     print(f"🔍 Finding build test runs since {check_time.isoformat()}...")
-    try:
-        output = run_gh_command(['run', 'list', '--workflow=build.yml', '--limit=50', '--json=databaseId,displayTitle,createdAt,status,conclusion'])
-        runs = json.loads(output)
-        recent_runs = []
-        for run in runs:
-            created_at = datetime.fromisoformat(run['createdAt'].replace('Z', '+00:00'))
-            if created_at > check_time:
-                run['createdAt_dt'] = created_at
-                recent_runs.append(run)
-        print(f"   Found {len(recent_runs)} build test runs after specified time")
-        return recent_runs
-    except subprocess.CalledProcessError as e:
-        print(f"  gh command failed: {e.stderr}")
-        return []
-    except Exception as e:
-        print(f"  Error: {e}")
-        return []
+    recent_runs = []
+    for run in history.build_runs_since(check_time):
+        recent_runs.append({
+            'databaseId': run['run_id'],
+            'displayTitle': run['title'] or '',
+            'createdAt': run['created_at'],
+            'createdAt_dt': datetime.fromisoformat(run['created_at'].replace('Z', '+00:00')),
+            'status': run['status'],
+            'conclusion': run['conclusion'],
+            'package': run['package'],
+            # build-batch.yml 的运行包含多个包，日志已经按包分类好了
+            'run_info': {'build_error': run['build_error'], 'push_conclusion': run['push_conclusion'] or ''}
+                        if (run['title'] or '').startswith('Build batch ') else None,
+        })
+    print(f"   Found {len(recent_runs)} build test runs after specified time")
+    return recent_runs
 
 def extract_package_name(title: str) -> str:
     if title.startswith('Build test for '):
@@ -61,148 +71,56 @@ def extract_package_name(title: str) -> str:
         return parts[0] if parts else ""
     return ""
 
-def query_aur_packages(package_names: List[str]) -> Dict[str, tuple]:
+def query_aur_packages(package_names: List[str], history: History = None) -> Dict[str, tuple]:
     if not package_names:
         return {}
     print(f"🌐 Querying AUR for {len(package_names)} packages last update time and maintainer info...")
-    query_parts = ["v=5", "type=info"]
-    for pkg in package_names:
-        query_parts.append(f"arg[]={urllib.request.quote(pkg)}")
-    url = f"https://aur.archlinux.org/rpc/?{'&'.join(query_parts)}"
-    with urllib.request.urlopen(url, timeout=30) as response:
-        data = json.loads(response.read().decode())
-        aur_info = {}
-        bot_identifiers = ['AutoUpdateBot', 'auto-update-bot@arch4edu.org', 'arch4edu']
-        for pkg_info in data.get('results', []):
-            name = pkg_info.get('Name')
-            last_modified = pkg_info.get('LastModified')
-            maintainer = pkg_info.get('Maintainer') or ''
-            comaintainers = pkg_info.get('CoMaintainers') or []
-            if name and last_modified:
-                is_co_maintainer = False
-                all_maintainers = [maintainer] + comaintainers
-                for maint in all_maintainers:
-                    if not maint:
-                        continue
-                    for bot_id in bot_identifiers:
-                        if bot_id in maint:
-                            is_co_maintainer = True
-                            break
-                    if is_co_maintainer:
+    results = AUR().info(package_names)
+    if history is not None:
+        history.record_aur(results)
+    aur_info = {}
+    bot_identifiers = ['AutoUpdateBot', 'auto-update-bot@arch4edu.org', 'arch4edu']
+    for name, pkg_info in results.items():
+        last_modified = pkg_info.last_modified
+        maintainer = pkg_info.maintainer or ''
+        comaintainers = pkg_info.comaintainers or []
+        if name and last_modified:
+            is_co_maintainer = False
+            all_maintainers = [maintainer] + comaintainers
+            for maint in all_maintainers:
+                if not maint:
+                    continue
+                for bot_id in bot_identifiers:
+                    if bot_id in maint:
+                        is_co_maintainer = True
                         break
-                aur_info[name] = (
-                    datetime.fromtimestamp(last_modified, tz=timezone.utc),
-                    is_co_maintainer,
-                    pkg_info.get('OutOfDate')  # 可能为 0 或 None
-                )
-        print(f"   Successfully retrieved AUR info for {len(aur_info)}/{len(package_names)} packages")
-        return aur_info
+                if is_co_maintainer:
+                    break
+            aur_info[name] = (
+                datetime.fromtimestamp(last_modified, tz=timezone.utc),
+                is_co_maintainer,
+                pkg_info.out_of_date  # 可能为 0 或 None
+            )
+    print(f"   Successfully retrieved AUR info for {len(aur_info)}/{len(package_names)} packages")
+    return aur_info
 
 def get_check_run_info(run_id: str) -> dict:
     """解析 check-update run 日志，提取 aur_missing 和 nvchecker_failed 的包集合"""
     try:
-        log_output = run_gh_command(['run', 'view', str(run_id), '--log'])
-        lines = log_output.split('\n')
-        
-        aur_missing_packages = set()
-        nvchecker_failed_packages = set()
-        in_process_updates = False
-        
-        for line in lines:
-            # 检测 Process updates 步骤
-            if 'Process updates' in line and 'python process-update.py' in line:
-                in_process_updates = True
-                continue
-            elif in_process_updates and line.startswith('update	'):
-                # 解析 "doesn't exist on AUR"
-                if "doesn't exist on AUR" in line:
-                    # 格式: "update	Process updates	HH:MM:SS.mmsZ python-librosa doesn't exist on AUR."
-                    parts = line.split()
-                    # 查找包名（通常在 "doesn't exist" 之前）
-                    for i, part in enumerate(parts):
-                        if "doesn't" in part or "exist" in part:
-                            if i > 0:
-                                pkg = parts[i-1]
-                                aur_missing_packages.add(pkg)
-                            break
-                # 解析 "Failed to check update for <pkg>: event=..."
-                elif "Failed to check update for" in line:
-                    # 格式: "update	Process updates	HH:MM:SS.mmsZ Failed to check update for twitch-dl: event=running cmd."
-                    # 提取包名
-                    import re
-                    match = re.search(r'Failed to check update for (\S+):', line)
-                    if match:
-                        pkg = match.group(1)
-                        # 排除 event=running cmd 的情况（已被 process-update 忽略）
-                        if "event=running cmd" not in line:
-                            nvchecker_failed_packages.add(pkg)
-                # 检测是否离开 Process updates 步骤
-                elif line.startswith('update	Post Run'):
-                    in_process_updates = False
-        
+        result = classify(read_run_log(run_id))
         return {
-            'aur_missing': aur_missing_packages,
-            'nvchecker_failed': nvchecker_failed_packages
+            'aur_missing': result.aur_missing,
+            'nvchecker_failed': result.nvchecker_failed
         }
     except Exception as e:
         print(f"   Error getting check run info for {run_id}: {e}")
         return {'aur_missing': set(), 'nvchecker_failed': set()}
 
 def get_run_info(run_id: str) -> dict:
-    """一次 log 调用，同时解析 build error、push conclusion"""
+    """一次读取日志，同时解析 build error、push conclusion"""
     try:
-        log_output = run_gh_command(['run', 'view', str(run_id), '--log'])
-        lines = log_output.split('\n')
-
-        build_error = "No==>ERRORerrors"
-        push_conclusion = ''
-        in_push_job = False
-        push_job_seen = False
-        dep_error_lines = []  # 收集包含依赖错误的行
-        dep_specific_lines = []  # 更具体的依赖错误（ pacman 的）
-
-        for line in lines:
-            # Build error detection
-            if build_error == "No==>ERRORerrors":
-                if '==> ERROR:' in line:
-                    error_text = line.split('==> ERROR:')[1].strip()
-                    if error_text:
-                        build_error = error_text
-                elif 'is greater than newver' in line:
-                    error_text = line.strip()
-                    if error_text:
-                        build_error = error_text
-
-            # Collect dependency-related errors (only from ==> ERROR: lines)
-            if '==> ERROR:' in line:
-                error_text = line.split('==> ERROR:')[1].strip()
-                if any(keyword in error_text.lower() for keyword in [
-                    'failed to install missing dependencies',
-                    'could not resolve all dependencies',
-                ]):
-                    dep_specific_lines.append(error_text)
-                    dep_error_lines.append(error_text)  # also add to general
-
-            # Push job detection & conclusion
-            if line.startswith('push\t'):
-                in_push_job = True
-                push_job_seen = True
-            elif line.startswith('build\t'):
-                in_push_job = False
-            elif line.startswith('##[error]') and in_push_job:
-                push_conclusion = 'failure'
-
-        # 优先使用更具体的 pacman 依赖错误
-        if dep_specific_lines:
-            build_error = dep_specific_lines[0]
-        elif dep_error_lines:
-            build_error = dep_error_lines[0]
-
-        # 如果 push job 存在且未发现 error，视为 success
-        if push_job_seen and not push_conclusion:
-            push_conclusion = 'success'
-
-        return {'build_error': build_error, 'push_conclusion': push_conclusion}
+        result = classify(read_run_log(run_id))
+        return {'build_error': result.build_error, 'push_conclusion': result.push_conclusion}
     except Exception as e:
         print(f"   Error getting run info for {run_id}: {e}")
         return {'build_error': f"Failed: {e}", 'push_conclusion': ''}
@@ -274,18 +192,25 @@ def extract_packages_from_paths(paths: List[str]) -> set:
             packages.add(pkg_name)
     return packages
 
-def process_builds(build_runs: List[Dict], aur_info: Dict[str, tuple], check_time: datetime, check_run_id: str):
+def process_builds(build_runs: List[Dict], aur_info: Dict[str, tuple], check_time: datetime, check_run_id: str, history: History = None):
     # Get manual fix commits since check time
     fixed_packages = get_manual_fix_commits_since(check_time)
     
     # 从 check-update run 中获取每个包的额外状态（aur_missing, nvchecker_failed）
     print("🔍 Analyzing check-update run for aur_missing and nvchecker_failed states...")
-    check_run_info = get_check_run_info(check_run_id)
+    check_run_info = history.check_events(check_run_id) if history is not None else {}
+    if not check_run_info:
+        check_run_info = get_check_run_info(check_run_id)
     aur_missing_packages = check_run_info.get('aur_missing', set())
     nvchecker_failed_packages = check_run_info.get('nvchecker_failed', set())
     print(f"   Found {len(aur_missing_packages)} packages missing on AUR")
     print(f"   Found {len(nvchecker_failed_packages)} packages with nvchecker failures")
 
+    index = ConfigIndex()
+
+    print(f"🔍 Fetching logs of {len(build_runs)} build test runs...")
+    run_infos = get_run_infos([build['run_id'] for build in build_runs if build['run_info'] is None], history)
+
     # Calculate dynamic column widths (no AURUpdate column)
     all_packages = [build['package'] for build in build_runs]
     max_pkg_len = max(len(pkg) for pkg in all_packages) if all_packages else 0
@@ -328,8 +253,8 @@ def process_builds(build_runs: List[Dict], aur_info: Dict[str, tuple], check_tim
             aur_success = False
             aur_out_of_date = None
 
-        # 获取 run 信息（build error 和 push conclusion），自动缓存
-        run_info = get_run_info(run_id)
+        # 获取 run 信息（build error 和 push conclusion），日志已缓存在本地
+        run_info = build['run_info'] or run_infos[run_id]
         build_error = run_info['build_error']
         push_conclusion = run_info['push_conclusion']
         build_failed = build_error != "No==>ERRORerrors"
@@ -339,11 +264,8 @@ def process_builds(build_runs: List[Dict], aur_info: Dict[str, tuple], check_tim
         flagged = False
         try:
             # 查找对应 config 文件
-            config_path_candidates = list(Path("config").rglob(f"{pkg}.yaml"))
-            if config_path_candidates:
-                config_path = config_path_candidates[0]
-                with open(config_path) as f:
-                    config = yaml.safe_load(f) or {}
+            if pkg in index:
+                config = index[pkg].config
                 local_out_of_date = config.get('out_of_date')
                 # aur_out_of_date 可能为 None 或 0（未标记）
                 if local_out_of_date and aur_out_of_date and aur_out_of_date > 0:
@@ -439,8 +361,10 @@ def main():
         print("=" * 60)
         print("🚀 AUR Auto-Update Actions Analysis Script")
         print("=" * 60)
-        check_time, check_run_id = get_check_update_time()
-        recent_build_runs = get_build_test_runs_since(check_time)
+        history = History()
+        history.sync(SYNC_DAYS)
+        check_time, check_run_id = get_check_update_time(history)
+        recent_build_runs = get_build_test_runs_since(history, check_time)
         if not recent_build_runs:
             print("⚠️  No build test runs found after check update")
             return
@@ -451,12 +375,13 @@ def main():
             run_id = run['databaseId']
             title = run.get('displayTitle', '')
             conclusion = run.get('conclusion')
-            pkg = extract_package_name(title)
+            pkg = run.get('package') or extract_package_name(title)
             if pkg and conclusion:
                 build_data.append({
                     'run_id': run_id,
                     'package': pkg,
                     'conclusion': conclusion,
+                    'run_info': run['run_info'],
                 })
                 if pkg not in package_names:
                     package_names.append(pkg)
@@ -468,8 +393,8 @@ def main():
         # Sort by package name for consistent output
         build_data.sort(key=lambda x: x['package'])
         
-        aur_info = query_aur_packages(package_names)
-        process_builds(build_data, aur_info, check_time, check_run_id)
+        aur_info = query_aur_packages(package_names, history)
+        process_builds(build_data, aur_info, check_time, check_run_id, history)
     except Exception as e:
         print(f"\n❌ Script execution failed: {e}")
         import traceback
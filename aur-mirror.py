@@ -0,0 +1,98 @@
+#!/bin/python
+"""
+Keep bare mirrors of the AUR repositories of all configured packages.
+
+Usage:
+    aur-mirror.py update [--workers N] [--prune] [pkgbase...]
+    aur-mirror.py clone <pkgbase> [directory]
+
+`update` creates missing mirrors and fetches the existing ones in parallel.
+`clone` clones a package with `--reference` to its mirror, so only the
+objects that are not mirrored yet are downloaded; bin/aur-clone uses it
+when $AUR_MIRROR is set.  The mirrors live in $AUR_MIRROR (default:
+aur-mirror) and are kept in the actions cache by the workflows.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from config_index import ConfigIndex
+
+AUR_URL = 'https://aur.archlinux.org/{}.git'
+AUR_SSH_URL = 'ssh://aur@aur.archlinux.org/{}.git'
+
+def mirror_dir():
+    return Path(os.environ.get('AUR_MIRROR') or 'aur-mirror')
+
+def git(*args):
+    return subprocess.run(['git'] + list(args), capture_output=True, text=True, check=True).stdout
+
+def update_mirror(root, pkgbase):
+    path = root / f'{pkgbase}.git'
+    start = time.monotonic()
+    try:
+        if path.exists():
+            git('-C', str(path), 'remote', 'update', '--prune')
+            action = 'Fetched'
+        else:
+            git('clone', '--mirror', '--quiet', AUR_URL.format(pkgbase), str(path))
+            action = 'Cloned'
+        return pkgbase, action, time.monotonic() - start, None
+    except subprocess.CalledProcessError as e:
+        return pkgbase, 'Failed', time.monotonic() - start, e.stderr.strip()
+
+def update(pkgbases, workers, prune):
+    root = mirror_dir()
+    root.mkdir(parents=True, exist_ok=True)
+    if not pkgbases:
+        pkgbases = [name for name, _ in ConfigIndex().items() if name not in ['example']]
+    start = time.monotonic()
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for pkgbase, action, elapsed, error in executor.map(lambda i: update_mirror(root, i), pkgbases):
+            if error is not None:
+                print(f"Failed to update the mirror of {pkgbase}: {error}")
+                failed.append(pkgbase)
+            elif action == 'Cloned':
+                print(f"Cloned {pkgbase} in {elapsed:.1f}s.")
+    if prune:
+        # 删除已经不在配置中的包的镜像
+        for path in root.glob('*.git'):
+            if path.name[:-4] not in pkgbases:
+                shutil.rmtree(path)
+                print(f"Removed the mirror of {path.name[:-4]}.")
+    print(f"Updated {len(pkgbases) - len(failed)} mirrors in {time.monotonic() - start:.1f}s, {len(failed)} failed.")
+    return 1 if failed else 0
+
+def clone(pkgbase, directory):
+    # 和 bin/aur-clone 一样，有 ssh 密钥时使用 ssh 地址，以便之后推送
+    url = AUR_SSH_URL if (Path.home() / '.ssh' / 'aur').exists() else AUR_URL
+    mirror = mirror_dir() / f'{pkgbase}.git'
+    # --dissociate 复制需要的对象，克隆出的仓库不依赖镜像目录
+    return subprocess.run(['git', 'clone', '--reference-if-able', str(mirror.resolve()), '--dissociate',
+                           url.format(pkgbase), directory or pkgbase]).returncode
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep bare mirrors of the AUR repositories of all configured packages.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    update_parser = subparsers.add_parser('update', help='create or fetch the mirrors')
+    update_parser.add_argument('pkgbases', nargs='*', help='default: all configured packages')
+    update_parser.add_argument('--workers', type=int, default=16)
+    update_parser.add_argument('--prune', action='store_true', help='remove mirrors of packages that are no longer configured')
+    clone_parser = subparsers.add_parser('clone', help='clone a package using its mirror')
+    clone_parser.add_argument('pkgbase')
+    clone_parser.add_argument('directory', nargs='?')
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        return update(args.pkgbases, args.workers, args.prune)
+    return clone(args.pkgbase, args.directory)
+
+if __name__ == '__main__':
+    sys.exit(main())
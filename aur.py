@@ -2,34 +2,109 @@ import os
 import re
 import requests
 import pickle
+from urllib.parse import quote
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+MAX_URL_LENGTH = 4000
+# pkgbase 页面的条件请求缓存，由使用 get_pkgbase 的脚本传给 AUR(cache=...)
+PAGE_CACHE_PATH = 'aur-pages.pickle'
 
 class PackageInfo:
 
     def __init__(self, info):
         self.name = info['Name']
         self.pkgbase = info['PackageBase']
+        self.version = info.get('Version')
         self.last_modified = info['LastModified']
         self.out_of_date = info['OutOfDate']
+        self.maintainer = info.get('Maintainer')
+        self.comaintainers = info.get('CoMaintainers', [])
 
     def __repr__(self):
         return f'<PackageInfo {self.name}>'
 
+def chunk_names(names, base_length):
+    """Split names into groups whose info query stays below MAX_URL_LENGTH."""
+    chunk = []
+    length = base_length
+    for name in names:
+        arg = len('&arg%5B%5D=') + len(quote(name))
+        if chunk and length + arg > MAX_URL_LENGTH:
+            yield chunk
+            chunk = []
+            length = base_length
+        chunk.append(name)
+        length += arg
+    if chunk:
+        yield chunk
+
+class Comment:
+
+    def __init__(self, comment_id, author, pinned, timestamp):
+        self.id = comment_id
+        self.author = author
+        self.pinned = pinned
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f'<Comment {self.id} by {self.author}>'
+
+class AURMaintenance(Exception):
+    pass
+
 class AUR:
 
     base_url = 'https://aur.archlinux.org'
     comment_id_re = re.compile(r'<a href="#comment-([^"]*)"')
+    comment_header_re = re.compile(r'(?:<a href="/account/([^"]+)"[^>]*>[^<]*</a>|([^\s<>]+)) commented on <a href="#comment-(\d+)" class="date">([^<]*)</a>')
+    comments_per_page = 10
+    maintenance_text = 'down due to maintenance'
 
-    def __init__(self, username, password, cookies=None):
+    def __init__(self, username=None, password=None, cookies=None, cache=None,
+                 pool_size=16, timeout=30, retries=5, backoff=2):
         self.username = username
         self.password = password
+        self.timeout = timeout
 
         self.session = requests.session()
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.cookies_file = cookies
 
         if not self.cookies_file is None and os.path.exists(self.cookies_file):
             with open(self.cookies_file, 'rb') as f:
                 self.session.cookies.update(pickle.load(f))
 
+        # Conditional request cache of pkgbase pages: url -> (etag, last_modified, text)
+        self.cache_file = cache
+        self.page_cache = {}
+        if not self.cache_file is None and os.path.exists(self.cache_file):
+            with open(self.cache_file, 'rb') as f:
+                self.page_cache = pickle.load(f)
+
+    def request(self, method, url, **kwargs):
+        """Send a request with the default timeout, failing clearly on AUR maintenance pages."""
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code >= 500 and not kwargs.get('stream') and self.maintenance_text in response.text:
+            raise AURMaintenance(f'AUR is {self.maintenance_text}.')
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def save_cache(self):
+        if not self.cache_file is None:
+            with open(self.cache_file, 'wb') as f:
+                pickle.dump(self.page_cache, f)
+
     def login(self):
         url = self.base_url + '/login'
         data = {
@@ -40,7 +115,7 @@ class AUR:
             'remember_me': 'on'
         }
         headers = {'Referer': AUR.base_url + '/login?next=/account/' + self.username}
-        response = self.session.post(url, data=data, headers=headers, allow_redirects=False)
+        response = self.post(url, data=data, headers=headers, allow_redirects=False)
         assert response.status_code == 303
 
         if not self.cookies_file is None:
@@ -49,55 +124,133 @@ class AUR:
 
     def get_profile(self):
         url = '/'.join([AUR.base_url, 'account', self.username])
-        response = self.session.get(url)
+        response = self.get(url)
         if response.status_code != 200:
             self.login()
-        response = self.session.get(url)
+            response = self.get(url)
         assert response.status_code == 200
         return response.text
 
     def search(self, by, keyword):
         url = '/'.join([AUR.base_url, 'rpc', 'v5', 'search', keyword])
         params = {'by': by}
-        response = self.session.get(url, params=params)
+        response = self.get(url, params=params)
         assert response.status_code == 200
         return [PackageInfo(i) for i in response.json()['results']]
 
+    def info(self, names):
+        """Look up many packages with as few RPC info requests as possible."""
+        url = '/'.join([AUR.base_url, 'rpc', 'v5', 'info'])
+        results = {}
+        for chunk in chunk_names(sorted(set(names)), len(url) + 1):
+            response = self.get(url, params={'arg[]': chunk})
+            assert response.status_code == 200
+            for i in response.json()['results']:
+                results[i['Name']] = PackageInfo(i)
+        return results
+
+    def get_pkgbase(self, pkgbase):
+        """Return the pkgbase page, or None if it doesn't exist, revalidating cached copies."""
+        url = '/'.join([AUR.base_url, 'pkgbase', pkgbase])
+        headers = {}
+        cached = self.page_cache.get(url)
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = self.get(url, headers=headers)
+        if response.status_code == 304:
+            return cached[2]
+        if response.status_code == 404:
+            self.page_cache.pop(url, None)
+            return None
+        assert response.status_code == 200
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            self.page_cache[url] = (etag, last_modified, response.text)
+        return response.text
+
     def flag(self, package, comment):
-        pass
+        url = '/'.join([AUR.base_url, 'pkgbase', package, 'flag'])
+        data = {'comments': comment}
+        response = self.post(url, data=data, allow_redirects=False)
+        assert response.status_code == 303
 
-    def unflag(self, package, comment):
-        pass
+    def unflag(self, package, comment=None):
+        # AUR doesn't take a comment when unflagging, the argument is kept for symmetry
+        url = '/'.join([AUR.base_url, 'pkgbase', package, 'unflag'])
+        response = self.post(url, allow_redirects=False)
+        assert response.status_code == 303
 
     def comment(self, pkgbase, comment):
         url = '/'.join([AUR.base_url, 'pkgbase', pkgbase, 'comments'])
         data = {'comment': comment}
-        response = self.session.post(url, data=data, allow_redirects=False)
+        response = self.post(url, data=data, allow_redirects=False)
         assert response.status_code == 303
 
-    def get_latest_comment_id(self, pkgbase, username=None):
+    def _scan_comments(self, lines):
+        pinned = False
+        for line in lines:
+            if 'Pinned Comments' in line:
+                pinned = True
+            elif 'Latest Comments' in line:
+                pinned = False
+            elif 'commented on' in line and '#comment-' in line:
+                match = AUR.comment_header_re.search(line)
+                if match:
+                    author = match.group(1) or match.group(2)
+                    yield Comment(match.group(3), author, pinned, match.group(4).strip())
+
+    def iter_comments(self, pkgbase, per_page=None):
+        """Yield the comments of a package page by page, pinned comments first."""
         url = '/'.join([AUR.base_url, 'pkgbase', pkgbase])
-        response = self.session.get(url)
-        assert response.status_code == 200
+        per_page = AUR.comments_per_page if per_page is None else per_page
+        seen = set()
+        offset = 0
+        while True:
+            params = {'O': offset, 'PP': per_page}
+            found = 0
+            with self.get(url, params=params, stream=True) as response:
+                assert response.status_code == 200
+                for comment in self._scan_comments(response.iter_lines(decode_unicode=True)):
+                    if not comment.pinned:
+                        found += 1
+                    if comment.id in seen:
+                        continue
+                    seen.add(comment.id)
+                    yield comment
+            if found < per_page:
+                break
+            offset += per_page
 
+    def get_latest_comment_id(self, pkgbase, username=None):
         username = self.username if username is None else username
-        lines = response.text.split('\n')
-        line = [line for line in lines if username in line and '#comment-' in line][0]
-        comment_id = AUR.comment_id_re.search(line).group(1)
-        return comment_id
+        url = '/'.join([AUR.base_url, 'pkgbase', pkgbase])
+        with self.get(url, stream=True) as response:
+            assert response.status_code == 200
+            # Stop reading the page at the first comment header of the user
+            for line in response.iter_lines(decode_unicode=True):
+                if username in line and '#comment-' in line:
+                    return AUR.comment_id_re.search(line).group(1)
+        raise Exception(f'No comment of {username} found on {pkgbase}.')
 
     def update_comment(self, pkgbase, comment_id, comment):
         url = '/'.join([AUR.base_url, 'pkgbase', pkgbase, 'comments', comment_id])
         data = {'comment': comment}
-        response = self.session.post(url, data=data, allow_redirects=False)
+        response = self.post(url, data=data, allow_redirects=False)
         assert response.status_code == 303
 
     def pin_comment(self, pkgbase, comment_id):
         url = '/'.join([AUR.base_url, 'pkgbase', pkgbase, 'comments', comment_id, 'pin'])
-        response = self.session.post(url, allow_redirects=False)
+        response = self.post(url, allow_redirects=False)
         assert response.status_code == 303
 
     def unpin_comment(self, pkgbase, comment_id):
         url = '/'.join([AUR.base_url, 'pkgbase', pkgbase, 'comments', comment_id, 'unpin'])
-        response = self.session.post(url, allow_redirects=False)
+        response = self.post(url, allow_redirects=False)
         assert response.status_code == 303
@@ -1,21 +1,44 @@
+import argparse
+import os
 import toml
 import subprocess
-import requests
 import re
 import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+import yaml
+
+from aur import AUR, PAGE_CACHE_PATH
 
 maintainer_line_re = re.compile(r'Maintainer:</th>[^<]*<td>([^<]*)</td>')
 maintainer_re = re.compile(r"[a-zA-z_]+")
 
-def check_sorted(config):
-    keys = [i for i in config.keys()]
-    if keys == sorted(keys):
-        print('The entries in nvchecker.toml is sorted.')
-    else:
-        raise Exception('The entries in nvchecker.toml is not well sorted.')
+def git(*args):
+    return subprocess.run(['git'] + list(args), capture_output=True, text=True, check=True).stdout
 
-def check_aur_maintainer(package):
-    content = requests.get(f'https://aur.archlinux.org/pkgbase/{package}').content.decode('utf-8')
+def load_blob(rev, path):
+    return yaml.safe_load(git('show', f'{rev}:{path}')) or {}
+
+def changed_packages(base, head='HEAD'):
+    """Return the nvchecker entries of the configs changed between base and head, read from git blobs."""
+    merge_base = git('merge-base', base, head).strip()
+    diff = git('diff', '--name-status', '--no-renames', merge_base, head, '--', 'config/')
+    changed = []
+    for line in diff.splitlines():
+        status, path = line.split('\t', 1)
+        path = PurePosixPath(path)
+        if path.suffix != '.yaml' or path.stem in ['example'] or status == 'D':
+            continue
+        new = load_blob(head, path)
+        old = load_blob(merge_base, path) if status != 'A' else {}
+        if new.get('nvchecker') != old.get('nvchecker'):
+            changed.append((path.stem, new['nvchecker']))
+    return changed
+
+def check_aur_maintainer(aur, package):
+    content = aur.get_pkgbase(package) or ''
     maintainers = maintainer_line_re.search(content.replace('\n', '')).group(1)
     maintainers = maintainer_re.findall(maintainers)
     if 'AutoUpdateBot' in maintainers:
@@ -23,48 +46,69 @@ def check_aur_maintainer(package):
     else:
         raise Exception(f'AutoUpdateBot is not a maintainer or co-maintainer of {package}.')
 
-def check_nvchecker(new_config):
+def check_aur_maintainers(packages):
+    aur = AUR(cache=PAGE_CACHE_PATH)
+    results = aur.info(packages)
+    pkgbases = dict((i.pkgbase, i) for i in results.values())
+    try:
+        for package in packages:
+            info = results.get(package) or pkgbases.get(package)
+            if info is None:
+                # 拆分包的 pkgbase 不是 pkgname，RPC 查不到时回退到 pkgbase 页面
+                check_aur_maintainer(aur, package)
+            elif 'AutoUpdateBot' in [info.maintainer] + info.comaintainers:
+                print(f'AutoUpdateBot is a maintainer or co-maintainer of {package}.')
+            else:
+                raise Exception(f'AutoUpdateBot is not a maintainer or co-maintainer of {package}.')
+    finally:
+        aur.save_cache()
+
+def run_nvchecker(package, package_config, timeout):
     config = {}
     config['__config__'] = {}
     config['__config__']['oldver'] = '/dev/null'
-    config['__config__']['keyfile'] = 'keyfile.toml'
+    config['__config__']['keyfile'] = os.path.abspath('config/keyfile.toml')
+    config[package] = package_config
 
-    for package, package_config in new_config:
-        config[package] = package_config
-
-    with open('check.toml', 'w') as f:
+    with tempfile.NamedTemporaryFile('w', suffix='.toml') as f:
         toml.dump(config, f)
+        f.flush()
+        try:
+            output = subprocess.run(['nvchecker', '--logger', 'json', '-c', f.name], capture_output=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return package, [], f'Timed out after {timeout}s.'
+    return package, output.stdout.decode('utf-8').split('\n')[:-1], None
 
-    output = subprocess.run(['nvchecker', '--logger', 'json', '-c', 'check.toml'], capture_output=True)
-    output = output.stdout.decode('utf-8').split('\n')[:-1]
-    for line in output:
-        result = json.loads(line)
-        if result['event'] in ['error', 'unexpected error happened']:
-            print(line)
-            raise Exception(f'Failed to find the version for {result["name"]}.')
-        else:
-            print(f'Successfully find version {result["version"]} for {result["name"]}.')
-
-def compare_dict(a, b):
-    a_json = json.dumps(a, sort_keys=True)
-    b_json = json.dumps(b, sort_keys=True)
-    return a_json == b_json
+def check_nvchecker(new_config, timeout=120, workers=8):
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_nvchecker, package, package_config, timeout) for package, package_config in new_config]
+        for future in futures:
+            package, output, error = future.result()
+            if error is not None:
+                print(f'Failed to find the version for {package}: {error}')
+                failed.append(package)
+                continue
+            for line in output:
+                result = json.loads(line)
+                if result['event'] in ['error', 'unexpected error happened']:
+                    print(line)
+                    failed.append(result.get('name', package))
+                elif 'version' in result:
+                    print(f'Successfully find version {result["version"]} for {result["name"]}.')
+    if failed:
+        raise Exception(f'Failed to find the version for {", ".join(failed)}.')
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the configs changed by a pull request.')
+    parser.add_argument('--base', default='origin/main')
+    parser.add_argument('--timeout', type=int, default=120, help='nvchecker timeout per package in seconds')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
 
-    subprocess.run(['git', 'checkout', '-q', 'main'])
-    with open('nvchecker.toml') as f:
-        old_config = toml.load(f)
-
-    subprocess.run(['git', 'checkout', '-q', '-'])
-    with open('nvchecker.toml') as f:
-        new_config = toml.load(f)
-
-    check_sorted(new_config)
-
-    new_config = [(i, new_config[i]) for i in new_config.keys() if not i in old_config or not compare_dict(new_config[i], old_config[i])]
-
-    for package, _ in new_config:
-        check_aur_maintainer(package)
+    new_config = changed_packages(args.base)
+    print(f'{len(new_config)} changed packages: {" ".join(package for package, _ in new_config)}')
 
-    check_nvchecker(new_config)
+    if new_config:
+        check_aur_maintainers([package for package, _ in new_config])
+        check_nvchecker(new_config, args.timeout, args.workers)
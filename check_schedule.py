@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Adaptive check schedule learned from the release history of each package.
+
+Usage:
+    check_schedule.py show [package...]
+    check_schedule.py due [--full]
+
+process-update.py records when every package was checked and when a new
+version was found.  nvchecker.py --schedule then only checks the packages
+that are due: packages that release often or released recently are checked
+every day, dormant ones on a growing interval, and every FULL_SWEEP_DAYS
+days all packages are checked regardless.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date
+
+HISTORY_PATH = 'release-history.json'
+DAY = 86400
+MIN_INTERVAL = 1
+MAX_INTERVAL = 14
+FULL_SWEEP_DAYS = 7
+MAX_RELEASES = 20
+# 定时任务的触发时间会有波动，留一点余量以免刚好差几分钟而被推迟一整天
+SLACK = DAY // 4
+
+
+def is_full_sweep(today=None):
+    """Every shard computes the same answer from the date alone."""
+    today = today or date.today()
+    return today.toordinal() % FULL_SWEEP_DAYS == 0
+
+
+class ReleaseHistory:
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.packages = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.packages = {}
+
+    def save(self):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.packages, f, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def merge(self, packages):
+        """Merge the history saved by another process, keeping the most recently checked entries."""
+        for package, entry in packages.items():
+            # 每个分片只检查自己的包，被检查过的条目 checked 更新
+            if entry.get('checked', 0) > self.packages.get(package, {}).get('checked', 0):
+                self.packages[package] = entry
+
+    def record_check(self, package, version=None, now=None):
+        now = int(now or time.time())
+        entry = self.packages.setdefault(package, {'releases': [], 'first_seen': now})
+        entry['checked'] = now
+        if version is None or entry.get('version') == version:
+            return
+        if 'version' in entry:
+            # 版本变了但没有经过 updated 事件（例如手动更新了 oldver），同样算作一次发布
+            self._add_release(entry, now)
+        entry['version'] = version
+
+    def record_release(self, package, version, now=None):
+        now = int(now or time.time())
+        entry = self.packages.setdefault(package, {'releases': [], 'first_seen': now})
+        entry['checked'] = now
+        if entry.get('version') == version:
+            # 构建推送前每天都会再次报告同一个新版本
+            return
+        self._add_release(entry, now)
+        entry['version'] = version
+
+    def _add_release(self, entry, now):
+        entry['releases'] = (entry['releases'] + [now])[-MAX_RELEASES:]
+
+    def interval(self, package, now=None):
+        """Return the check interval of a package in days."""
+        entry = self.packages.get(package)
+        if entry is None:
+            return MIN_INTERVAL
+        now = now or time.time()
+        releases = entry['releases']
+        # 距离上次发布越久，检查间隔越长；常发布的包由发布间隔的中位数限制
+        since = (now - (releases[-1] if releases else entry['first_seen'])) / DAY
+        interval = since / 4
+        if len(releases) >= 2:
+            gap = statistics.median(b - a for a, b in zip(releases, releases[1:])) / DAY
+            interval = min(interval, gap / 4)
+        return max(MIN_INTERVAL, min(MAX_INTERVAL, int(interval)))
+
+    def is_due(self, package, now=None):
+        entry = self.packages.get(package)
+        if entry is None or 'checked' not in entry:
+            return True
+        now = now or time.time()
+        return now - entry['checked'] + SLACK >= self.interval(package, now) * DAY
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect the adaptive check schedule.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    show_parser = subparsers.add_parser('show', help='print the interval and last check of packages')
+    show_parser.add_argument('packages', nargs='*')
+    due_parser = subparsers.add_parser('due', help='list the packages that are due today')
+    due_parser.add_argument('--full', action='store_true', help='pretend today is a full sweep')
+    args = parser.parse_args()
+
+    history = ReleaseHistory()
+    now = time.time()
+    if args.command == 'show':
+        print(f"{'Package':<40} {'Interval':>8} {'Releases':>8}  Last checked")
+        for package in args.packages or sorted(history.packages):
+            entry = history.packages.get(package, {'releases': []})
+            checked = time.strftime('%Y-%m-%d %H:%M', time.gmtime(entry['checked'])) if 'checked' in entry else '-'
+            print(f"{package:<40} {history.interval(package, now):>8} {len(entry['releases']):>8}  {checked}")
+    elif args.command == 'due':
+        full = args.full or is_full_sweep()
+        for package in sorted(history.packages):
+            if full or history.is_due(package, now):
+                print(package)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
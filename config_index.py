@@ -0,0 +1,218 @@
+#!/bin/python
+"""
+Index of the package configs under config/.
+
+The tree is scanned once and every package is mapped to its YAML file, the
+parsed config and the optional .override/.repository files.  The parsed
+configs are persisted together with the file mtimes and content hashes, so
+later runs only re-parse the files that actually changed.
+
+Usage:
+    config_index.py path <pkgbase> [yaml|override|repository]
+    config_index.py get <pkgbase> <key>
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import yaml
+
+CACHE_VERSION = 1
+KINDS = ('yaml', 'override', 'repository')
+PARALLEL_THRESHOLD = 64
+
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def _parse_yaml(content):
+    try:
+        return yaml.load(content, Loader=Loader) or {}, None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+class PackageConfig:
+
+    def __init__(self, name, path, config, digest):
+        self.name = name
+        self.path = path
+        self.config = config
+        self.digest = digest
+        self.override = None
+        self.repository = None
+
+    def get(self, key, default=None):
+        return self.config.get(key, default)
+
+    def __repr__(self):
+        return f'<PackageConfig {self.name}>'
+
+
+class ConfigIndex:
+
+    def __init__(self, root='config', cache='config-index.pickle'):
+        self.root = Path(root)
+        self.cache_file = Path(cache) if cache else None
+        self.packages = {}
+        self.changed = []
+        self.errors = {}
+        self._files = {}
+        self._dirty = False
+        self._load_cache()
+        self.scan()
+
+    def _load_cache(self):
+        if self.cache_file is None or not self.cache_file.exists():
+            return
+        try:
+            with open(self.cache_file, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') == CACHE_VERSION and data.get('root') == str(self.root):
+                self._files = data['files']
+        except Exception:
+            self._files = {}
+
+    def _save_cache(self):
+        if self.cache_file is None:
+            return
+        data = {'version': CACHE_VERSION, 'root': str(self.root), 'files': self._files}
+        tmp = self.cache_file.with_name(self.cache_file.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            pickle.dump(data, f)
+        os.replace(tmp, self.cache_file)
+
+    def _stat(self, path):
+        """Return the cache record of a YAML file, or its content if it has to be parsed."""
+        key = str(path)
+        stat = path.stat()
+        cached = self._files.get(key)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached
+
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        self._dirty = True
+        if cached and cached[2] == digest:
+            self._files[key] = (stat.st_mtime_ns, stat.st_size, digest, cached[3])
+            return self._files[key]
+        self._files[key] = (stat.st_mtime_ns, stat.st_size, digest, None)
+        return content
+
+    def _parse(self, pending):
+        paths = list(pending)
+        contents = [pending[path] for path in paths]
+        if len(paths) >= PARALLEL_THRESHOLD:
+            with ProcessPoolExecutor() as executor:
+                results = list(executor.map(_parse_yaml, contents, chunksize=16))
+        else:
+            results = [_parse_yaml(content) for content in contents]
+
+        for path, (config, error) in zip(paths, results):
+            key = str(path)
+            if error is None:
+                self._files[key] = self._files[key][:3] + (config,)
+                self.changed.append(path)
+            else:
+                del self._files[key]
+                self.errors[path] = error
+
+    def scan(self):
+        self.packages = {}
+        self.changed = []
+        self.errors = {}
+        self._dirty = False
+        yamls = []
+        extras = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in sorted(filenames):
+                path = Path(dirpath) / filename
+                if path.suffix == '.yaml':
+                    yamls.append(path)
+                elif path.suffix in ('.override', '.repository'):
+                    extras.append(path)
+
+        pending = {}
+        for path in yamls:
+            record = self._stat(path)
+            if isinstance(record, bytes):
+                pending[path] = record
+        self._parse(pending)
+
+        for path in yamls:
+            record = self._files.get(str(path))
+            if record is not None and path.stem not in self.packages:
+                self.packages[path.stem] = PackageConfig(path.stem, path, record[3], record[2])
+
+        for path in extras:
+            if path.stem in self.packages:
+                setattr(self.packages[path.stem], path.suffix[1:], path)
+
+        removed = set(self._files) - set(str(path) for path in yamls)
+        for key in removed:
+            del self._files[key]
+        if self._dirty or removed:
+            self._save_cache()
+
+    def __contains__(self, name):
+        return name in self.packages
+
+    def __getitem__(self, name):
+        return self.packages[name]
+
+    def __iter__(self):
+        return iter(sorted(self.packages))
+
+    def __len__(self):
+        return len(self.packages)
+
+    def get(self, name, default=None):
+        return self.packages.get(name, default)
+
+    def items(self):
+        return [(name, self.packages[name]) for name in self]
+
+    def path(self, name, kind='yaml'):
+        package = self.packages.get(name)
+        if package is None:
+            return None
+        return package.path if kind == 'yaml' else getattr(package, kind)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Look up package configs under config/.')
+    parser.add_argument('--root', default='config')
+    parser.add_argument('--cache', default='config-index.pickle')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    path_parser = subparsers.add_parser('path', help='print the path of a config file')
+    path_parser.add_argument('pkgbase')
+    path_parser.add_argument('kind', nargs='?', default='yaml', choices=KINDS)
+
+    get_parser = subparsers.add_parser('get', help='print a top-level key of a config')
+    get_parser.add_argument('pkgbase')
+    get_parser.add_argument('key')
+
+    args = parser.parse_args()
+    index = ConfigIndex(args.root, args.cache)
+
+    if args.command == 'path':
+        path = index.path(args.pkgbase, args.kind)
+        if path is None:
+            return 1
+        print(path)
+    elif args.command == 'get':
+        package = index.get(args.pkgbase)
+        if package is None or package.get(args.key) is None:
+            return 1
+        print(package.get(args.key))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from github import GithubException
+
+RETRY_STATUS = [403, 429, 500, 502, 503, 504]
+
+
+class Dispatcher:
+    """Send workflow dispatches from a bounded pool, throttled by the GitHub rate limit."""
+
+    def __init__(self, github, repo, workflow, ref='main', workers=4, retries=5, reserve=50):
+        self.github = github
+        self.workflow = github.get_repo(repo).get_workflow(workflow)
+        self.ref = ref
+        self.retries = retries
+        self.reserve = reserve
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.futures = []
+        self.dispatched = []
+        self.failures = []
+        self.start = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def throttle(self):
+        with self.lock:
+            remaining, limit = self.github.rate_limiting
+            if remaining > self.reserve:
+                return
+            wait = max(self.github.rate_limiting_resettime - time.time(), 0) + 1
+            print(f"Only {remaining}/{limit} GitHub API requests left, waiting {wait:.0f}s for the reset.")
+            time.sleep(wait)
+
+    def _dispatch(self, inputs, description):
+        for attempt in range(self.retries + 1):
+            self.throttle()
+            try:
+                if not self.workflow.create_dispatch(self.ref, inputs, throw=True):
+                    raise Exception('GitHub did not accept the dispatch')
+                print(f"Triggered {description}.")
+                with self.lock:
+                    self.dispatched.append(description)
+                return True
+            except GithubException as e:
+                if e.status not in RETRY_STATUS or attempt == self.retries:
+                    raise
+                headers = e.headers or {}
+                wait = int(headers.get('retry-after', 0)) or 2 ** attempt * 5
+                print(f"Dispatching {description} failed with {e.status}, retrying in {wait}s.")
+                time.sleep(wait)
+
+    def _run(self, inputs, description):
+        try:
+            return self._dispatch(inputs, description)
+        except:
+            print(f"Failed to trigger {description}.")
+            traceback.print_exc()
+            with self.lock:
+                self.failures.append(description)
+            return False
+
+    def submit(self, inputs, description):
+        future = self.executor.submit(self._run, inputs, description)
+        self.futures.append(future)
+        return future
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        elapsed = time.monotonic() - self.start
+        print(f"Dispatched {len(self.dispatched)} workflow runs in {elapsed:.1f}s, {len(self.failures)} failed.")
+        for description in self.failures:
+            print(f"  Failed: {description}")
+        return self.failures
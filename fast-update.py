@@ -0,0 +1,164 @@
+#!/bin/python
+"""
+Update pkgver, pkgrel and checksums of an AUR package without a build.
+
+Usage:
+    fast-update.py <pkgbase> <pkgver> [directory]
+
+Rewrites pkgver/pkgrel in PKGBUILD like bin/update-pkgver, downloads the
+sources through the source cache instead of updpkgsums, and updates the same
+fields of .SRCINFO in place instead of `makepkg --printsrcinfo`.  The
+result is the same `git diff -- PKGBUILD .SRCINFO` the push job applies.
+Packages with an override script are refused, since only a full build
+runs it.
+"""
+
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from config_index import ConfigIndex
+from source_cache import VCS_PREFIXES, SourceCache, hash_file, read_arrays, source_filename, source_location
+from vercmp import vercmp
+
+
+class FastUpdateError(Exception):
+    pass
+
+
+def update_pkgver(pkgbuild, pkgver):
+    """Rewrite pkgver and reset pkgrel, refusing versions older than the current one."""
+    content = pkgbuild.read_text()
+    match = re.search(r'^pkgver=(.*)$', content, re.M)
+    if match is None:
+        raise FastUpdateError('No pkgver in PKGBUILD.')
+    oldver = match.group(1).strip().strip('\'"')
+    if vercmp(oldver, pkgver) > 0:
+        raise FastUpdateError(f'The oldver {oldver} is greater than newver {pkgver}.')
+    if oldver != pkgver:
+        content = re.sub(r'^pkgver=.*$', f'pkgver={pkgver}', content, flags=re.M)
+        content = re.sub(r'^pkgrel=.*$', 'pkgrel=1', content, flags=re.M)
+        pkgbuild.write_text(content)
+    return oldver
+
+
+def hash_source(cache, directory, pkgbase, pkgver, entry, algorithms):
+    """Return {algorithm: digest} of a source, downloading remote files into the source cache."""
+    url = source_location(entry)
+    if '://' in url:
+        # 和 source_cache.py restore 一样，只复用带版本号的地址
+        path = cache.download(url, pkgbase, source_filename(entry), reuse=pkgver in url)
+    else:
+        path = directory / source_location(entry)
+    return hash_file(path, algorithms)
+
+
+def compute_checksums(cache, directory, pkgbase, pkgver, arrays, workers=4):
+    """Return the new checksum arrays for every source array."""
+    jobs = []
+    checksums = dict((name, list(values)) for name, values in arrays.items() if not name.startswith('source'))
+    for name in checksums:
+        algorithm, _, arch = name.partition('sums')
+        if algorithm == 'ck':
+            raise FastUpdateError('cksums are not supported.')
+        sources = arrays.get('source' + arch, [])
+        if len(sources) != len(checksums[name]):
+            raise FastUpdateError(f'{name} has {len(checksums[name])} entries for {len(sources)} sources.')
+        for i, entry in enumerate(sources):
+            # VCS 源和原本就是 SKIP 的源保持 SKIP
+            if checksums[name][i] == 'SKIP' or source_location(entry).startswith(VCS_PREFIXES):
+                checksums[name][i] = 'SKIP'
+            else:
+                jobs.append((name, i, algorithm, entry))
+
+    # 每个源只下载一次，同时计算所有需要的校验和
+    by_entry = {}
+    for name, i, algorithm, entry in jobs:
+        by_entry.setdefault(entry, set()).add(algorithm)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        digests = dict(zip(by_entry, executor.map(lambda i: hash_source(cache, directory, pkgbase, pkgver, i, by_entry[i]), by_entry)))
+    for name, i, algorithm, entry in jobs:
+        checksums[name][i] = digests[entry][algorithm]
+    return checksums
+
+
+def replace_array(content, name, values):
+    """Replace a bash array assignment the way updpkgsums formats it."""
+    pattern = re.compile(rf'^{re.escape(name)}=\([^)]*\)', re.M)
+    if not pattern.search(content):
+        raise FastUpdateError(f'Cannot find {name} in PKGBUILD.')
+    indent = '\n' + ' ' * (len(name) + 2)
+    replacement = f'{name}=(' + indent.join(f"'{value}'" for value in values) + ')'
+    return pattern.sub(lambda _: replacement, content, count=1)
+
+
+def update_srcinfo(srcinfo, pkgver, pkgrel, arrays):
+    """Replace the values of pkgver, pkgrel and the given arrays in the pkgbase section of .SRCINFO."""
+    lines = srcinfo.read_text().splitlines()
+    positions = {}
+    for i, line in enumerate(lines):
+        if line.startswith('pkgname = '):
+            break
+        key, sep, _ = line.strip().partition(' = ')
+        if sep:
+            positions.setdefault(key, []).append(i)
+    values = dict(arrays, pkgver=[pkgver], pkgrel=[pkgrel])
+    for key, new in values.items():
+        old = positions.get(key, [])
+        if len(old) != len(new):
+            raise FastUpdateError(f'.SRCINFO has {len(old)} {key} entries, expected {len(new)}.')
+        for i, value in zip(old, new):
+            lines[i] = f'\t{key} = {value}'
+    srcinfo.write_text('\n'.join(lines) + '\n')
+
+
+def fast_update(pkgbase, pkgver, directory, cache):
+    directory = Path(directory)
+    pkgbuild = directory / 'PKGBUILD'
+    oldver = update_pkgver(pkgbuild, pkgver)
+    arrays = read_arrays(directory)
+    checksums = compute_checksums(cache, directory, pkgbase, pkgver, arrays)
+
+    content = pkgbuild.read_text()
+    for name, values in checksums.items():
+        content = replace_array(content, name, values)
+    pkgbuild.write_text(content)
+
+    pkgrel = re.search(r'^pkgrel=(.*)$', content, re.M).group(1).strip().strip('\'"')
+    sources = dict((name, values) for name, values in arrays.items() if name.startswith('source'))
+    update_srcinfo(directory / '.SRCINFO', pkgver, pkgrel, dict(sources, **checksums))
+    return oldver
+
+
+def main():
+    if len(sys.argv) not in [3, 4]:
+        print(__doc__.strip())
+        return 1
+    pkgbase, pkgver = sys.argv[1:3]
+    directory = sys.argv[3] if len(sys.argv) == 4 else pkgbase
+
+    package = ConfigIndex().get(pkgbase)
+    if package is not None and package.override is not None:
+        print(f"{pkgbase} has an override script, it needs a full build.")
+        return 1
+    cache = SourceCache()
+    try:
+        oldver = fast_update(pkgbase, pkgver, directory, cache)
+    except (FastUpdateError, requests.RequestException, subprocess.CalledProcessError, OSError) as e:
+        print(f"Failed to update {pkgbase} to {pkgver}: {e}")
+        return 1
+    finally:
+        # 和 source_cache.py store 一样只保留这个版本能复用的文件
+        cache.discard_stale(pkgbase, pkgver)
+        cache.prune(keep=cache.reusable(pkgbase, pkgver))
+        cache.save()
+    print(f"Updated {pkgbase} from {oldver} to {pkgver}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,30 @@
 #!/usr/bin/env python3
 """
-Generate standardized AUR flag comment from a GitHub Actions run ID.
+Generate standardized AUR flag comments from GitHub Actions run IDs.
 
-Usage: generate-flag-comment.py <run-id>
+Usage:
+    generate-flag-comment.py [--json] <run-id>...
+    generate-flag-comment.py [--json] --since-check
 
 Extracts package name and new version from the run's display title.
-Fetches current version from AUR RPC and checks log for dependency issues.
+Fetches current versions from AUR RPC and checks logs for dependency issues.
+With --since-check, all build tests since the last check-update run that did
+not push are used.  A build-batch.yml run yields one comment per package
+it built.  Run metadata and logs are fetched concurrently and all AUR
+versions are resolved with one batched RPC query.
 """
 
+import argparse
 import subprocess
 import json
-import urllib.request
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from aur import AUR
+from log_classifier import classify, classify_batch, read_run_log
+
+REPO = 'arch4edu/aur-auto-update'
 
 
 def get_github_run_metadata(run_id: str) -> dict:
@@ -64,51 +76,46 @@ def parse_display_title(title: str) -> tuple:
     return None, None
 
 
-def get_aur_current_version(package: str) -> str:
-    """Fetch current version from AUR RPC."""
+def get_aur_current_versions(packages: list) -> dict:
+    """Fetch current versions from AUR RPC in one batched query."""
     try:
-        url = f"https://aur.archlinux.org/rpc/?v=5&type=info&arg[]={urllib.request.quote(package)}"
-        with urllib.request.urlopen(url, timeout=30) as response:
-            data = json.loads(response.read().decode())
-            if data.get('resultcount', 0) > 0:
-                pkg_info = data['results'][0]
-                return pkg_info.get('Version', 'unknown')
+        results = AUR().info(packages)
     except Exception:
-        pass
-    return 'unknown'
+        results = {}
+    return dict((package, (results[package].version if package in results else None) or 'unknown') for package in packages)
 
 
 def get_run_dependency_info(run_id: str) -> dict:
     """Check run log for dependency resolution errors."""
     try:
-        result = subprocess.run(
-            ['gh', 'run', 'view', str(run_id), '--log'],
-            capture_output=True, text=True, check=True, timeout=30
-        )
-        log = result.stdout
-        
-        has_dep_error = False
-        missing_dep = None
-        
-        for line in log.split('\n'):
-            if '==> ERROR:' in line:
-                error_text = line.split('==> ERROR:')[1].strip().lower()
-                if 'failed to install missing dependencies' in error_text or 'could not resolve all dependencies' in error_text:
-                    has_dep_error = True
-        
-        if has_dep_error:
-            for line in log.split('\n'):
-                if 'target not found:' in line:
-                    missing_dep = line.split('target not found:')[1].strip()
-                    break
-        
-        return {'has_dependency_error': has_dep_error, 'missing_dependency': missing_dep}
+        result = classify(read_run_log(run_id))
+        missing_dep = result.missing_dependency if result.has_dependency_error else None
+        return {'has_dependency_error': result.has_dependency_error, 'missing_dependency': missing_dep,
+                'push_conclusion': result.push_conclusion}
     except subprocess.CalledProcessError as e:
         return {'error': f'gh command failed: {e.stderr}'}
     except Exception as e:
         return {'error': str(e)}
 
 
+def get_failed_runs_since_check() -> list:
+    """Return metadata of the build test runs since the last check-update run that did not push."""
+    check = json.loads(subprocess.run(
+        ['gh', 'run', 'list', '--workflow', 'check-update.yml', '--limit', '1', '--json', 'createdAt'],
+        capture_output=True, text=True, check=True, timeout=30
+    ).stdout)
+    if not check:
+        return []
+    runs = []
+    for workflow in ['build.yml', 'build-batch.yml']:
+        runs += json.loads(subprocess.run(
+            ['gh', 'run', 'list', '--workflow', workflow, '--status', 'completed', '--limit', '500',
+             '--created', f'>={check[0]["createdAt"]}', '--json', 'databaseId,displayTitle,url'],
+            capture_output=True, text=True, check=True, timeout=60
+        ).stdout)
+    return [{'run_id': str(run['databaseId']), 'display_title': run['displayTitle'], 'url': run['url']} for run in runs]
+
+
 def generate_flag_comment(package: str, oldver: str, newver: str, run_id: str, missing_dep: str = None) -> str:
     """Generate standardized AUR flag comment."""
     lines = [
@@ -128,45 +135,105 @@ def generate_flag_comment(package: str, oldver: str, newver: str, run_id: str, m
     return "\n".join(lines)
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: generate-flag-comment.py <run-id>")
-        print("Example: generate-flag-comment.py 22032164368")
-        return 1
-    
-    run_id = sys.argv[1]
-    
-    # Get run metadata
-    metadata = get_github_run_metadata(run_id)
-    if 'error' in metadata:
-        print(f"Error: {metadata['error']}")
-        return 1
-    
+def collect_batch_run(run_id: str, metadata: dict) -> list:
+    """Gather the flag comments of every package built by a build-batch.yml run."""
+    try:
+        packages = classify_batch(read_run_log(run_id))
+    except subprocess.CalledProcessError as e:
+        return [{'run_id': run_id, 'error': f'gh command failed: {e.stderr}'}]
+    except Exception as e:
+        return [{'run_id': run_id, 'error': str(e)}]
+    return [{
+        'run_id': run_id,
+        'package': package,
+        'newver': newver,
+        'missing_dependency': result.missing_dependency if result.has_dependency_error else None,
+        'push_conclusion': result.push_conclusion,
+        'url': metadata.get('url'),
+    } for package, (newver, result) in sorted(packages.items())]
+
+
+def collect_run(run_id: str, metadata: dict = None) -> list:
+    """Gather everything needed for the flag comments of a run except the AUR versions."""
+    if metadata is None:
+        metadata = get_github_run_metadata(run_id)
+        if 'error' in metadata:
+            return [{'run_id': run_id, 'error': metadata['error']}]
+
     display_title = metadata.get('display_title', '')
+    if display_title.startswith('Build batch '):
+        return collect_batch_run(run_id, metadata)
     package, newver = parse_display_title(display_title)
-    
     if not package:
-        print(f"Error: Could not extract package name from run title: '{display_title}'")
-        return 1
-    
+        return [{'run_id': run_id, 'error': f"Could not extract package name from run title: '{display_title}'"}]
     if not newver:
-        print(f"Error: Could not extract new version from run title: '{display_title}'")
-        return 1
-    
-    # Get current version from AUR
-    oldver = get_aur_current_version(package)
-    
+        return [{'run_id': run_id, 'error': f"Could not extract new version from run title: '{display_title}'"}]
+
     # Check for dependency issues
     dep_info = get_run_dependency_info(run_id)
     missing_dep = None
     if dep_info.get('has_dependency_error'):
         missing_dep = dep_info.get('missing_dependency')
-    
-    # Generate and output comment
-    comment = generate_flag_comment(package, oldver, newver, run_id, missing_dep)
-    print(comment)
-    
-    return 0
+    return [{
+        'run_id': run_id,
+        'package': package,
+        'newver': newver,
+        'missing_dependency': missing_dep,
+        'push_conclusion': dep_info.get('push_conclusion'),
+        'url': metadata.get('url'),
+    }]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate standardized AUR flag comments from GitHub Actions runs.')
+    parser.add_argument('run_ids', nargs='*', help='build test run IDs, e.g. 22032164368')
+    parser.add_argument('--since-check', action='store_true', help='use all build tests since the last check-update run that did not push')
+    parser.add_argument('--json', action='store_true', help='print a JSON array instead of the comments')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    if not args.run_ids and not args.since_check:
+        parser.print_usage()
+        return 1
+
+    runs = [(run_id, None) for run_id in dict.fromkeys(args.run_ids)]
+    if args.since_check:
+        try:
+            runs += [(run['run_id'], run) for run in get_failed_runs_since_check()]
+        except subprocess.CalledProcessError as e:
+            print(f"Error: gh command failed: {e.stderr}")
+            return 1
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = [result for results in executor.map(lambda run: collect_run(*run), runs) for result in results]
+
+    if args.since_check:
+        # 只保留没有推送成功的构建；明确给出的 run id 总是保留
+        explicit = set(args.run_ids)
+        results = [i for i in results if i['run_id'] in explicit or i.get('push_conclusion') != 'success']
+
+    # Get current versions from AUR
+    oldvers = get_aur_current_versions(sorted(set(i['package'] for i in results if 'package' in i)))
+    for i in results:
+        if 'package' in i:
+            i['oldver'] = oldvers[i['package']]
+            i['comment'] = generate_flag_comment(i['package'], i['oldver'], i['newver'], i['run_id'], i['missing_dependency'])
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    elif len(results) == 1 and len(runs) == 1 and not args.since_check:
+        if 'error' in results[0]:
+            print(f"Error: {results[0]['error']}")
+        else:
+            print(results[0]['comment'])
+    else:
+        for i in results:
+            if 'error' in i:
+                print(f"## Run {i['run_id']}\nError: {i['error']}\n")
+            else:
+                print(f"## {i['package']} {i['newver']} (run {i['run_id']})\n{i['comment']}\n")
+
+    return 1 if any('error' in i for i in results) else 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Local SQLite history of check-update and build test runs.
+
+Usage:
+    history.py sync [--days N] [--max-pages N]
+    history.py report [--days N] [package]
+
+`sync` only downloads runs of the last N days that are not yet complete in
+the database and classifies the logs of newly completed runs, so the
+history grows incrementally and later analysis is a local query.
+"""
+
+import argparse
+import json
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from log_classifier import CACHE_DIR, classify, classify_batch, read_run_log
+
+REPO = 'arch4edu/aur-auto-update'
+DB_PATH = CACHE_DIR / 'history.sqlite3'
+WORKFLOWS = ['check-update.yml', 'build.yml', 'build-batch.yml']
+WORKERS = 8
+# 和 report 默认的时间范围一致；更早的运行的日志多半已经过期了
+SYNC_DAYS = 30
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    workflow TEXT NOT NULL,
+    title TEXT,
+    package TEXT,
+    pkgver TEXT,
+    created_at TEXT,
+    status TEXT,
+    conclusion TEXT,
+    duration REAL,
+    classified INTEGER NOT NULL DEFAULT 0,
+    build_error TEXT,
+    push_conclusion TEXT,
+    vercmp_failed INTEGER,
+    aur_maintenance INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_package ON runs (package, created_at);
+CREATE INDEX IF NOT EXISTS runs_created_at ON runs (workflow, created_at);
+CREATE TABLE IF NOT EXISTS checks (
+    run_id INTEGER NOT NULL,
+    package TEXT NOT NULL,
+    event TEXT NOT NULL,
+    version TEXT,
+    PRIMARY KEY (run_id, package, event)
+);
+CREATE INDEX IF NOT EXISTS checks_package ON checks (package);
+CREATE TABLE IF NOT EXISTS batch_builds (
+    run_id INTEGER NOT NULL,
+    package TEXT NOT NULL,
+    pkgver TEXT,
+    build_error TEXT,
+    push_conclusion TEXT,
+    vercmp_failed INTEGER,
+    PRIMARY KEY (run_id, package)
+);
+CREATE INDEX IF NOT EXISTS batch_builds_package ON batch_builds (package);
+-- build.yml 每次运行构建一个包，build-batch.yml 的每个包单独一行
+CREATE VIEW IF NOT EXISTS builds AS
+    SELECT run_id, title, package, pkgver, created_at, status, conclusion, duration, classified,
+           build_error, push_conclusion, vercmp_failed
+    FROM runs WHERE workflow = 'build.yml'
+    UNION ALL
+    SELECT runs.run_id, runs.title, batch_builds.package, batch_builds.pkgver, runs.created_at, runs.status,
+           runs.conclusion, runs.duration, runs.classified, batch_builds.build_error, batch_builds.push_conclusion,
+           batch_builds.vercmp_failed
+    FROM batch_builds JOIN runs ON runs.run_id = batch_builds.run_id;
+CREATE TABLE IF NOT EXISTS aur (
+    package TEXT PRIMARY KEY,
+    version TEXT,
+    last_modified INTEGER,
+    out_of_date INTEGER,
+    fetched_at INTEGER
+);
+'''
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+
+
+def parse_build_title(title):
+    if title and title.startswith('Build test for '):
+        parts = title[15:].split(' ', 1)
+        return parts[0], parts[1] if len(parts) > 1 else None
+    return None, None
+
+
+class History:
+
+    def __init__(self, path=DB_PATH, repo=REPO):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        self.repo = repo
+
+    def close(self):
+        self.db.close()
+
+    def fetch_runs_page(self, workflow, page, since):
+        created = since.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        output = subprocess.run(
+            ['gh', 'api', f'repos/{self.repo}/actions/workflows/{workflow}/runs?per_page=100&page={page}&created=%3E%3D{created}'],
+            capture_output=True, text=True, check=True
+        ).stdout
+        return json.loads(output)['workflow_runs']
+
+    def sync_runs(self, workflow, since, max_pages=None):
+        """Store new and updated runs since a time, stopping at the first page that is already complete locally."""
+        page = 1
+        new = 0
+        while max_pages is None or page <= max_pages:
+            runs = self.fetch_runs_page(workflow, page, since)
+            if not runs:
+                break
+            known = 0
+            for run in runs:
+                row = self.db.execute('SELECT status FROM runs WHERE run_id = ?', (run['id'],)).fetchone()
+                if row is not None and row['status'] == 'completed':
+                    known += 1
+                    continue
+                new += 1
+                package, pkgver = parse_build_title(run.get('display_title'))
+                started = parse_time(run.get('run_started_at'))
+                updated = parse_time(run.get('updated_at'))
+                duration = (updated - started).total_seconds() if started and updated and run['status'] == 'completed' else None
+                self.db.execute(
+                    'INSERT OR REPLACE INTO runs (run_id, workflow, title, package, pkgver, created_at, status, conclusion, duration) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (run['id'], workflow, run.get('display_title'), package, pkgver, run['created_at'],
+                     run['status'], run.get('conclusion'), duration)
+                )
+            self.db.commit()
+            if known == len(runs):
+                break
+            page += 1
+        print(f"   {workflow}: {new} new or updated runs")
+
+    def classify_run(self, run_id, workflow):
+        try:
+            function = classify_batch if workflow == 'build-batch.yml' else classify
+            return run_id, function(read_run_log(run_id)), None
+        except Exception as e:
+            return run_id, None, e
+
+    def classify_pending(self, since):
+        rows = self.db.execute(
+            "SELECT run_id, workflow FROM runs WHERE status = 'completed' AND classified = 0 AND created_at > ?",
+            (since.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),)
+        ).fetchall()
+        if not rows:
+            return
+        print(f"   Classifying logs of {len(rows)} completed runs...")
+        workflows = dict((row['run_id'], row['workflow']) for row in rows)
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            for run_id, result, error in executor.map(self.classify_run, workflows, workflows.values()):
+                if error is not None:
+                    # 日志可能已经过期，标记出来以免每次同步都重试
+                    print(f"   Error getting run log for {run_id}: {error}")
+                    self.db.execute('UPDATE runs SET classified = -1 WHERE run_id = ?', (run_id,))
+                    self.db.commit()
+                    continue
+                if workflows[run_id] == 'build-batch.yml':
+                    self.db.executemany(
+                        'INSERT OR REPLACE INTO batch_builds (run_id, package, pkgver, build_error, push_conclusion, vercmp_failed) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        [(run_id, package, pkgver, i.build_error, i.push_conclusion, i.vercmp_failed)
+                         for package, (pkgver, i) in result.items()]
+                    )
+                    self.db.execute('UPDATE runs SET classified = 1 WHERE run_id = ?', (run_id,))
+                    self.db.commit()
+                    continue
+                if workflows[run_id] == 'check-update.yml':
+                    events = [(package, 'dispatched', version) for package, version in result.dispatched.items()]
+                    events += [(package, 'aur_missing', None) for package in result.aur_missing]
+                    events += [(package, 'nvchecker_failed', None) for package in result.nvchecker_failed]
+                    self.db.executemany(
+                        'INSERT OR REPLACE INTO checks (run_id, package, event, version) VALUES (?, ?, ?, ?)',
+                        [(run_id,) + event for event in events]
+                    )
+                self.db.execute(
+                    'UPDATE runs SET classified = 1, build_error = ?, push_conclusion = ?, vercmp_failed = ?, aur_maintenance = ? WHERE run_id = ?',
+                    (result.build_error, result.push_conclusion, result.vercmp_failed, result.aur_maintenance, run_id)
+                )
+                self.db.commit()
+
+    def sync(self, days=SYNC_DAYS, max_pages=None):
+        print("🔄 Syncing local run history...")
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+        for workflow in WORKFLOWS:
+            self.sync_runs(workflow, since, max_pages)
+        self.classify_pending(since)
+
+    def record_aur(self, infos):
+        now = int(time.time())
+        self.db.executemany(
+            'INSERT OR REPLACE INTO aur (package, version, last_modified, out_of_date, fetched_at) VALUES (?, ?, ?, ?, ?)',
+            [(name, i.version, i.last_modified, i.out_of_date, now) for name, i in infos.items()]
+        )
+        self.db.commit()
+
+    def latest_run(self, workflow):
+        return self.db.execute('SELECT * FROM runs WHERE workflow = ? ORDER BY created_at DESC LIMIT 1', (workflow,)).fetchone()
+
+    def run_info(self, run_id):
+        row = self.db.execute('SELECT build_error, push_conclusion FROM runs WHERE run_id = ? AND classified = 1', (run_id,)).fetchone()
+        return None if row is None else {'build_error': row['build_error'], 'push_conclusion': row['push_conclusion'] or ''}
+
+    def check_events(self, run_id):
+        events = {}
+        for row in self.db.execute('SELECT package, event FROM checks WHERE run_id = ?', (run_id,)):
+            events.setdefault(row['event'], set()).add(row['package'])
+        return events
+
+    def build_runs_since(self, since):
+        """Return the build tests since a time, one row per package of a batch."""
+        return self.db.execute(
+            "SELECT * FROM builds WHERE created_at > ? ORDER BY created_at DESC",
+            (since.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),)
+        ).fetchall()
+
+    def report(self, since, package=None):
+        query = (
+            "SELECT package, COUNT(*) AS builds, "
+            "SUM(push_conclusion = 'success') AS pushed, "
+            "SUM(classified AND build_error != 'No==>ERRORerrors') AS failed, "
+            "SUM(vercmp_failed) AS vercmp_failed, "
+            "AVG(duration) AS duration, "
+            "(SELECT pkgver FROM builds AS latest WHERE latest.package = builds.package "
+            "ORDER BY latest.created_at DESC LIMIT 1) AS pkgver "
+            "FROM builds WHERE package IS NOT NULL AND created_at > ?"
+        )
+        params = [since.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')]
+        if package is not None:
+            query += " AND package = ?"
+            params.append(package)
+        return self.db.execute(query + " GROUP BY package ORDER BY package", params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local history of check and build runs.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    sync_parser = subparsers.add_parser('sync', help='fetch new runs and classify their logs')
+    sync_parser.add_argument('--days', type=int, default=SYNC_DAYS, help=f'only sync runs of the last N days (default: {SYNC_DAYS})')
+    sync_parser.add_argument('--max-pages', type=int, default=None)
+    report_parser = subparsers.add_parser('report', help='summarise build results per package')
+    report_parser.add_argument('--days', type=int, default=30)
+    report_parser.add_argument('package', nargs='?')
+    args = parser.parse_args()
+
+    history = History()
+    try:
+        if args.command == 'sync':
+            history.sync(args.days, args.max_pages)
+        elif args.command == 'report':
+            since = datetime.now(timezone.utc) - timedelta(days=args.days)
+            print(f"{'Package':<40} {'Builds':>6} {'Pushed':>6} {'Failed':>6} {'Vercmp':>6} {'Avg(s)':>7}  Last pkgver")
+            for row in history.report(since, args.package):
+                duration = f"{row['duration']:.0f}" if row['duration'] is not None else '-'
+                print(f"{row['package']:<40} {row['builds']:>6} {row['pushed'] or 0:>6} {row['failed'] or 0:>6} "
+                      f"{row['vercmp_failed'] or 0:>6} {duration:>7}  {row['pkgver']}")
+    except subprocess.CalledProcessError as e:
+        print(f"gh command failed: {e.stderr}")
+        return 1
+    finally:
+        history.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
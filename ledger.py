@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Ledger of the build tests dispatched by process-update.py.
+
+Usage:
+    ledger.py show [package...]
+    ledger.py refresh
+
+Every dispatch is recorded with the pkgbase, pkgver and a hash of the
+config (the YAML plus the override and repository files).  The outcome is
+filled in later from the build.yml runs or from the result artifacts of
+the build-batch.yml runs, and a version that failed to build is not
+dispatched again until its version or config changes.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone
+
+import requests
+import toml
+from github import Github
+
+LEDGER_PATH = 'dispatch-ledger.json'
+# 超过这个时间还没找到对应的运行，就当作派发丢失，允许重新派发
+PENDING_TIMEOUT = 2 * 86400
+# 构建失败时才跳过；其它结果（取消、环境出错、推送失败）都可以重试
+SKIP_OUTCOMES = ['failure', 'pending']
+
+
+def config_hash(package):
+    """Hash the files of a PackageConfig that affect the build test."""
+    sha = hashlib.sha256(package.digest.encode())
+    for path in [package.override, package.repository]:
+        if path is not None:
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()
+
+
+def parse_title(title):
+    if title and title.startswith('Build test for '):
+        parts = title[15:].split(' ', 1)
+        if len(parts) == 2:
+            return parts[0], parts[1]
+    return None, None
+
+
+def run_outcome(run):
+    """Derive the outcome of a completed build.yml run from its jobs."""
+    if run.conclusion != 'success':
+        return 'cancelled' if run.conclusion == 'cancelled' else 'error'
+    jobs = dict((job.name, job.conclusion) for job in run.jobs())
+    # 快速更新时 build 任务被跳过，由 fast 任务产出 diff
+    build = jobs.get('fast') if jobs.get('build') == 'skipped' else jobs.get('build')
+    # 构建步骤都带了 `|| :`，构建失败时 build 任务仍然成功，但没有产出包，push 任务被跳过
+    if build != 'success':
+        return 'error'
+    if jobs.get('push') == 'skipped':
+        return 'failure'
+    return 'success' if jobs.get('push') == 'success' else 'push-failure'
+
+
+def read_artifact(artifact, token):
+    """Yield the JSON files in the zip archive of an artifact."""
+    response = requests.get(artifact.archive_download_url, headers={'Authorization': f'token {token}'}, timeout=60)
+    response.raise_for_status()
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        for name in archive.namelist():
+            if name.endswith('.json'):
+                yield json.loads(archive.read(name))
+
+
+def batch_outcomes(run, token):
+    """Derive the outcome of every package of a completed build-batch.yml run from its result artifacts."""
+    if run.conclusion == 'cancelled':
+        return {}
+    built = {}
+    pushed = {}
+    for artifact in run.get_artifacts():
+        if artifact.name == 'build-results':
+            built = dict((result['pkgbase'], result) for result in read_artifact(artifact, token))
+        elif artifact.name == 'push-results':
+            pushed = dict((result['pkgbase'], result['push']) for result in read_artifact(artifact, token))
+    outcomes = {}
+    for pkgbase, result in built.items():
+        # 克隆失败等环境错误和 build.yml 的 error 一样可以重试
+        if result.get('error') or result['built'] is None:
+            outcomes[pkgbase] = 'error'
+        elif not result['built']:
+            outcomes[pkgbase] = 'failure'
+        else:
+            outcomes[pkgbase] = 'success' if pushed.get(pkgbase) == 'success' else 'push-failure'
+    return outcomes
+
+
+class DispatchLedger:
+
+    def __init__(self, path=LEDGER_PATH):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def save(self):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def merge(self, entries):
+        """Merge the ledger saved by another process, keeping the latest dispatch of every package."""
+        for pkgbase, entry in entries.items():
+            current = self.entries.get(pkgbase)
+            if current is None or entry['dispatched_at'] > current['dispatched_at']:
+                self.entries[pkgbase] = entry
+            elif entry['dispatched_at'] == current['dispatched_at'] and current['outcome'] == 'pending':
+                # 同一次派发，另一份已经查到了结果
+                self.entries[pkgbase] = entry
+
+    def skip_reason(self, pkgbase, pkgver, digest, now=None):
+        """Return why the build test should not be dispatched, or None."""
+        entry = self.entries.get(pkgbase)
+        if entry is None or entry['pkgver'] != pkgver or entry['config'] != digest:
+            return None
+        if entry['outcome'] not in SKIP_OUTCOMES:
+            return None
+        if entry['outcome'] == 'pending':
+            if (now or time.time()) - entry['dispatched_at'] > PENDING_TIMEOUT:
+                return None
+            return 'it is still pending'
+        return f"it failed in run {entry['run_id']} with the same config"
+
+    def record_dispatch(self, pkgbase, pkgver, digest, batch=None, now=None):
+        self.entries[pkgbase] = {
+            'pkgver': pkgver,
+            'config': digest,
+            'outcome': 'pending',
+            'dispatched_at': int(now or time.time()),
+            'run_id': None,
+        }
+        if batch is not None:
+            self.entries[pkgbase]['batch'] = batch
+
+    def pending(self, batch):
+        """Return the pending entries of single (batch=False) or batched dispatches, giving up on lost ones."""
+        now = time.time()
+        pending = {}
+        for pkgbase, entry in self.entries.items():
+            if entry['outcome'] != 'pending' or ('batch' in entry) != batch:
+                continue
+            if now - entry['dispatched_at'] > PENDING_TIMEOUT:
+                entry['outcome'] = 'lost'
+            else:
+                pending[pkgbase] = entry
+        return pending
+
+    def runs_since(self, workflow, entries):
+        since = datetime.fromtimestamp(min(entry['dispatched_at'] for entry in entries), timezone.utc)
+        # 派发时间和运行的创建时间之间有少量误差
+        since -= timedelta(minutes=5)
+        return workflow.get_runs(created=f">={since.strftime('%Y-%m-%dT%H:%M:%SZ')}")
+
+    def refresh(self, workflow):
+        """Fill in the outcomes of pending dispatches from the runs of the build workflow."""
+        pending = self.pending(batch=False)
+        if not pending:
+            return 0
+        resolved = 0
+        for run in self.runs_since(workflow, pending.values()):
+            pkgbase, pkgver = parse_title(run.display_title)
+            entry = pending.get(pkgbase)
+            if entry is None or entry['pkgver'] != pkgver or run.created_at.timestamp() < entry['dispatched_at'] - 300:
+                continue
+            # 运行按创建时间倒序列出，只看每个包最新的一次
+            del pending[pkgbase]
+            entry['run_id'] = run.id
+            if run.status == 'completed':
+                entry['outcome'] = run_outcome(run)
+                resolved += 1
+            if not pending:
+                break
+        return resolved
+
+    def refresh_batches(self, workflow, token):
+        """Fill in the outcomes of pending batched dispatches from the result artifacts of the build-batch runs."""
+        batches = {}
+        for pkgbase, entry in self.pending(batch=True).items():
+            batches.setdefault(entry['batch'], {})[pkgbase] = entry
+        if not batches:
+            return 0
+        resolved = 0
+        for run in self.runs_since(workflow, [entry for entries in batches.values() for entry in entries.values()]):
+            title = run.display_title or ''
+            entries = batches.get(title[12:]) if title.startswith('Build batch ') else None
+            if entries is None:
+                continue
+            del batches[title[12:]]
+            outcomes = batch_outcomes(run, token) if run.status == 'completed' else {}
+            for pkgbase, entry in entries.items():
+                entry['run_id'] = run.id
+                if run.status == 'completed':
+                    entry['outcome'] = outcomes.get(pkgbase, 'error')
+                    resolved += 1
+            if not batches:
+                break
+        return resolved
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect the ledger of dispatched build tests.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    show_parser = subparsers.add_parser('show', help='print the ledger entries')
+    show_parser.add_argument('packages', nargs='*')
+    subparsers.add_parser('refresh', help='fill in the outcomes of pending dispatches')
+    args = parser.parse_args()
+
+    ledger = DispatchLedger()
+    if args.command == 'show':
+        print(f"{'Package':<40} {'Pkgver':<24} {'Outcome':<12} {'Run':>12}  Dispatched")
+        for pkgbase in args.packages or sorted(ledger.entries):
+            entry = ledger.entries.get(pkgbase)
+            if entry is None:
+                continue
+            dispatched = time.strftime('%Y-%m-%d %H:%M', time.gmtime(entry['dispatched_at']))
+            print(f"{pkgbase:<40} {entry['pkgver']:<24} {entry['outcome']:<12} {entry['run_id'] or '-':>12}  {dispatched}")
+    elif args.command == 'refresh':
+        token = toml.load('config/keyfile.toml')['keys']['github.com']
+        repo = Github(token).get_repo('arch4edu/aur-auto-update')
+        resolved = ledger.refresh(repo.get_workflow('build.yml'))
+        resolved += ledger.refresh_batches(repo.get_workflow('build-batch.yml'), token)
+        print(f"Resolved {resolved} pending dispatches.")
+        ledger.save()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Single-pass classifier for GitHub Actions logs of the check-update and build workflows.
+
+Usage:
+    log_classifier.py [--batch] <run-id|log-file|->
+    log_classifier.py --benchmark <size-in-MB>
+
+The log is read line by line from a pipe or file, so memory usage does not
+depend on the size of the log.  With --batch, the log of a build-batch.yml
+run is classified per package.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'aur-auto-update'
+RUN_LOG_CACHE = CACHE_DIR / 'run-logs'
+
+NO_ERROR = "No==>ERRORerrors"
+MAX_ERRORS = 100
+DEPENDENCY_KEYWORDS = [
+    'failed to install missing dependencies',
+    'could not resolve all dependencies',
+]
+
+# 先用一个合并的正则过滤，只有可能命中的行才进入具体规则
+interesting_re = re.compile(r"==> ERROR:|target not found:|is greater than newver|##\[error\]|down due to maintenance|doesn't exist on AUR|Failed to check update for|Triggered (?:build test|fast update|build batch)")
+error_re = re.compile(r'==> ERROR:(.*)')
+target_re = re.compile(r'target not found:(.*)')
+aur_missing_re = re.compile(r"(\S+) doesn't exist on AUR")
+check_failed_re = re.compile(r'Failed to check update for (\S+):')
+# 单个构建是 "<pkgbase> <pkgver>"，批量构建是逗号分隔的多个 "<pkgbase> <pkgver>"
+dispatched_re = re.compile(r'Triggered (?:build test for|fast update for|build batch \S+ with \d+ packages:) (.+)\.$')
+batch_group_re = re.compile(r'##\[group\](?:Build|Push) (\S+) (\S+)$')
+# process-update.py 所在的步骤：分片前在 update 任务中，分片后在 check (i/n) 任务中
+PROCESS_STEPS = ['process updates', 'run nvchecker and process updates']
+
+
+class LogResult:
+
+    def __init__(self):
+        self.build_error = NO_ERROR
+        self.errors = []
+        self.dependency_errors = []
+        self.missing_dependency = None
+        self.vercmp_failed = False
+        self.push_seen = False
+        self.push_failed = False
+        self.aur_maintenance = False
+        self.aur_missing = set()
+        self.nvchecker_failed = set()
+        self.dispatched = {}
+
+    @property
+    def has_dependency_error(self):
+        return bool(self.dependency_errors)
+
+    @property
+    def push_conclusion(self):
+        if not self.push_seen:
+            return ''
+        return 'failure' if self.push_failed else 'success'
+
+    def to_dict(self):
+        return {
+            'build_error': self.build_error,
+            'errors': self.errors,
+            'dependency_errors': self.dependency_errors,
+            'missing_dependency': self.missing_dependency,
+            'vercmp_failed': self.vercmp_failed,
+            'push_conclusion': self.push_conclusion,
+            'aur_maintenance': self.aur_maintenance,
+            'aur_missing': sorted(self.aur_missing),
+            'nvchecker_failed': sorted(self.nvchecker_failed),
+            'dispatched': self.dispatched,
+        }
+
+
+class Classifier:
+    """Classify log lines one at a time, so one pass can feed several classifiers."""
+
+    def __init__(self):
+        self.result = LogResult()
+        self.first_error = None
+        self.job = None
+
+    def feed(self, line):
+        result = self.result
+        # gh run view --log 的每一行都以 "<job>\t<step>\t" 开头
+        if line.startswith('push\t'):
+            self.job = 'push'
+            result.push_seen = True
+        elif line.startswith(('build\t', 'fast\t')):
+            self.job = 'build'
+        elif line.startswith(('update\t', 'check (')):
+            self.job = 'check'
+
+        if not interesting_re.search(line):
+            return
+
+        match = error_re.search(line)
+        if match:
+            error_text = match.group(1).strip()
+            if error_text:
+                if len(result.errors) < MAX_ERRORS:
+                    result.errors.append(error_text)
+                if self.first_error is None:
+                    self.first_error = error_text
+                if any(keyword in error_text.lower() for keyword in DEPENDENCY_KEYWORDS):
+                    if len(result.dependency_errors) < MAX_ERRORS:
+                        result.dependency_errors.append(error_text)
+        elif 'is greater than newver' in line:
+            result.vercmp_failed = True
+            if self.first_error is None and line.strip():
+                self.first_error = line.strip()
+
+        if result.missing_dependency is None and 'target not found:' in line:
+            result.missing_dependency = target_re.search(line).group(1).strip()
+
+        if self.job == 'push' and '##[error]' in line:
+            result.push_failed = True
+
+        if 'down due to maintenance' in line:
+            result.aur_maintenance = True
+
+        fields = line.split('\t', 2)
+        if self.job == 'check' and len(fields) == 3 and fields[1].lower() in PROCESS_STEPS:
+            match = aur_missing_re.search(line)
+            if match:
+                result.aur_missing.add(match.group(1))
+            match = check_failed_re.search(line)
+            if match and 'event=running cmd' not in line:
+                result.nvchecker_failed.add(match.group(1))
+            match = dispatched_re.search(line)
+            if match:
+                for build in match.group(1).split(', '):
+                    package, _, version = build.partition(' ')
+                    result.dispatched[package] = version
+
+    def finish(self):
+        result = self.result
+        # 优先使用更具体的 pacman 依赖错误
+        if result.dependency_errors:
+            result.build_error = result.dependency_errors[0]
+        elif self.first_error is not None:
+            result.build_error = self.first_error
+        return result
+
+
+def classify(lines):
+    """Classify an iterable of log lines in one pass."""
+    classifier = Classifier()
+    for line in lines:
+        classifier.feed(line)
+    return classifier.finish()
+
+
+def classify_batch(lines):
+    """Classify the log of a build-batch.yml run per package; return {pkgbase: (pkgver, LogResult)}."""
+    classifiers = {}
+    versions = {}
+    current = None
+    for line in lines:
+        # bin/build-test 和推送步骤把每个包的输出放在 "Build/Push <pkgbase> <pkgver>" 分组里
+        if '##[group]' in line or '##[endgroup]' in line:
+            match = batch_group_re.search(line)
+            current = match.group(1) if match else None
+            if match:
+                versions[current] = match.group(2)
+                classifiers.setdefault(current, Classifier())
+        if current is not None:
+            classifiers[current].feed(line)
+    return dict((pkgbase, (versions[pkgbase], classifier.finish())) for pkgbase, classifier in classifiers.items())
+
+
+def iter_lines(f):
+    """Yield decoded lines without line endings from a binary or text stream."""
+    for line in f:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        yield line.rstrip('\r\n')
+
+
+def classify_run(run_id):
+    """Classify the log of a run while it is being downloaded by gh."""
+    with subprocess.Popen(['gh', 'run', 'view', str(run_id), '--log'], stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
+        result = classify(iter_lines(proc.stdout))
+        stderr = proc.stderr.read().decode('utf-8', 'replace')
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args, stderr=stderr)
+    return result
+
+
+def fetch_run_log(run_id):
+    """Download a run log into the local gzip cache; logs of completed runs never change."""
+    path = RUN_LOG_CACHE / f'{run_id}.log.gz'
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with subprocess.Popen(['gh', 'run', 'view', str(run_id), '--log'], stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
+            with gzip.open(tmp, 'wb') as f:
+                shutil.copyfileobj(proc.stdout, f)
+            stderr = proc.stderr.read().decode('utf-8', 'replace')
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args, stderr=stderr)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return path
+
+
+def read_run_log(run_id):
+    """Read a cached run log line by line."""
+    with gzip.open(fetch_run_log(run_id), 'rt', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+def synthetic_log(size):
+    """Yield about `size` bytes of build log lines with a few interesting lines mixed in."""
+    filler = [
+        'build\tBuild test\t2026-01-01T00:00:00.0000000Z   -> Compiling src/module.c with -O2 -pipe -fno-plt',
+        'build\tBuild test\t2026-01-01T00:00:00.0000000Z checking for a thread-safe mkdir -p... /usr/bin/mkdir -p',
+        'build\tBuild test\t2026-01-01T00:00:00.0000000Z [ 42%] Building CXX object CMakeFiles/app.dir/main.cpp.o',
+    ]
+    written = 0
+    i = 0
+    while written < size:
+        line = filler[i % len(filler)]
+        if i % 100000 == 99999:
+            line = 'build\tBuild test\t2026-01-01T00:00:00.0000000Z error: target not found: python-foo'
+        written += len(line) + 1
+        i += 1
+        yield line
+    yield 'build\tBuild test\t2026-01-01T00:00:00.0000000Z ==> ERROR: Could not resolve all dependencies.'
+    yield 'push\tPush\t2026-01-01T00:00:00.0000000Z ##[error]Process completed with exit code 1.'
+
+
+def benchmark(size_mb):
+    size = size_mb * 1024 * 1024
+    start = time.perf_counter()
+    result = classify(synthetic_log(size))
+    elapsed = time.perf_counter() - start
+
+    # tracemalloc 会明显拖慢速度，所以单独跑一遍来测内存
+    tracemalloc.start()
+    classify(synthetic_log(size))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Classified {size_mb} MB in {elapsed:.2f}s ({size_mb / elapsed:.1f} MB/s), peak memory {peak / 1024:.0f} KiB.")
+    print(json.dumps(result.to_dict(), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Classify a GitHub Actions log in a single pass.')
+    parser.add_argument('source', nargs='?', help="run id, log file or '-' for stdin")
+    parser.add_argument('--batch', action='store_true', help='classify a build-batch.yml log per package')
+    parser.add_argument('--benchmark', type=int, metavar='MB', help='classify a synthetic log of this size')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return 0
+    if args.source is None:
+        parser.print_usage()
+        return 1
+
+    function = classify_batch if args.batch else classify
+    if args.source == '-':
+        result = function(iter_lines(sys.stdin.buffer))
+    elif args.source.isdigit():
+        result = classify_batch(read_run_log(args.source)) if args.batch else classify_run(args.source)
+    else:
+        with open(args.source, 'rb') as f:
+            result = function(iter_lines(f))
+    if args.batch:
+        output = dict((pkgbase, dict(result.to_dict(), pkgver=pkgver)) for pkgbase, (pkgver, result) in result.items())
+    else:
+        output = result.to_dict()
+    print(json.dumps(output, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
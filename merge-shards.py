@@ -0,0 +1,85 @@
+#!/bin/python
+"""
+Merge the results of sharded check-update jobs.
+
+Usage:
+    merge-shards.py [--log nvchecker.log] [--oldver oldver.json] [--newver PATH] SHARD_DIR...
+
+Every SHARD_DIR holds the nvchecker.log, oldver.json and newver.json of one
+`nvchecker.py --shard I/N` job.  The logs are concatenated and the version
+files are merged, so nvtake sees one complete run.  The shards stream their
+log into process-update.py themselves, so their release-history.json,
+dispatch-ledger.json and nvtake.txt are merged as well.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import toml
+
+from check_schedule import ReleaseHistory
+from ledger import DispatchLedger
+from vercmp import vercmp
+from verfile import read_verfile, write_verfile
+
+def version_of(entry):
+    return entry['version'] if isinstance(entry, dict) else entry
+
+def merge_newer(versions, shard_versions):
+    """Merge the versions of a shard, keeping the existing entry when it is newer."""
+    for name, entry in shard_versions.items():
+        # 分片的 oldver 是检查开始时的快照，不能覆盖之后写回的 oldver
+        if name not in versions or vercmp(str(version_of(entry)), str(version_of(versions[name]))) > 0:
+            versions[name] = entry
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge the results of sharded check-update jobs.')
+    parser.add_argument('shards', nargs='+', help='directories with the nvchecker.log, oldver.json and newver.json of a shard')
+    parser.add_argument('--log', default='nvchecker.log')
+    parser.add_argument('--oldver', default='oldver.json')
+    parser.add_argument('--newver', default=None, help='defaults to the newver of config/__config__.toml')
+    args = parser.parse_args()
+
+    newver_file = args.newver or toml.load('config/__config__.toml')['__config__']['newver']
+
+    # 从现有文件开始合并，失败的分片不会让其余包的版本丢失
+    oldver = read_verfile(args.oldver)
+    newver = read_verfile(newver_file)
+    history = ReleaseHistory()
+    ledger = DispatchLedger()
+    nvtake = []
+    with open(args.log, 'wb') as log:
+        for shard in args.shards:
+            shard_log = os.path.join(shard, 'nvchecker.log')
+            if not os.path.exists(shard_log):
+                print(f'Missing {shard_log}, the shard probably failed.', file=sys.stderr)
+                continue
+            with open(shard_log, 'rb') as f:
+                shutil.copyfileobj(f, log)
+            shard_oldver = read_verfile(os.path.join(shard, 'oldver.json'))
+            shard_newver = read_verfile(os.path.join(shard, 'newver.json'))
+            merge_newer(oldver, shard_oldver)
+            newver.update(shard_newver)
+            print(f'Merged {shard}: {len(shard_oldver)} oldver, {len(shard_newver)} newver entries.', file=sys.stderr)
+            history.merge(ReleaseHistory(os.path.join(shard, 'release-history.json')).packages)
+            ledger.merge(DispatchLedger(os.path.join(shard, 'dispatch-ledger.json')).entries)
+            nvtake_file = os.path.join(shard, 'nvtake.txt')
+            if os.path.exists(nvtake_file):
+                with open(nvtake_file) as f:
+                    nvtake.extend(f.read().split())
+
+    # oldver.json 保持 nvchecker.py 生成的格式
+    with open(args.oldver, 'w') as f:
+        json.dump(oldver, f)
+    write_verfile(newver_file, newver)
+    history.save()
+    ledger.save()
+    with open('nvtake.txt', 'w') as f:
+        f.write(' '.join(nvtake))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
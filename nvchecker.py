@@ -1,35 +1,104 @@
 #!/bin/python
+import argparse
 import json
 import logging
 import os
 import sys
 import traceback
+import zlib
 from pathlib import Path
 
 import toml
 import yaml
 
+from check_schedule import ReleaseHistory, is_full_sweep
+from config_index import ConfigIndex
+
+def load_configs(paths):
+    for i in paths:
+        try:
+            with open(i) as f:
+                config = yaml.safe_load(f)
+            print("Loaded", i)
+            yield i, config
+        except:
+            print("Failed to load", i)
+            traceback.print_exc()
+
+def write_if_changed(path, content):
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == content:
+                print("Unchanged", path)
+                return
+    with open(path, "w") as f:
+        f.write(content)
+    print("Wrote", path)
+
+def parse_shard(value):
+    index, count = [int(i) for i in value.split("/")]
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"invalid shard {value}")
+    return index, count
+
+def in_shard(package, shard):
+    """Assign packages to shards by a hash that is stable across runs and machines."""
+    if shard is None:
+        return True
+    index, count = shard
+    return zlib.crc32(package.encode()) % count == index - 1
+
+parser = argparse.ArgumentParser(description="Generate nvchecker.toml and oldver.json from the configs.")
+parser.add_argument("paths", nargs="*", help="only load these YAML files")
+parser.add_argument("--shard", type=parse_shard, metavar="I/N", help="only include the packages of shard I out of N")
+parser.add_argument("--schedule", action="store_true", help="only include the packages that are due according to release-history.json")
+parser.add_argument("--full", action="store_true", help="include all packages even with --schedule")
+args = parser.parse_args()
+
 nvchecker_toml = toml.load("config/__config__.toml")
 
+if args.paths:
+    configs = load_configs([Path(j) for j in args.paths])
+else:
+    index = ConfigIndex()
+    for i in index.changed:
+        print("Loaded", i)
+    for i, error in index.errors.items():
+        print("Failed to load", i, error)
+    print(f"Indexed {len(index)} packages, {len(index.changed)} changed.")
+    configs = [(package.path, package.config) for _, package in index.items()]
+
+schedule = None
+if args.schedule and not args.full and not is_full_sweep():
+    schedule = ReleaseHistory()
+    # 配置有改动的包总是检查一次
+    changed = set() if args.paths else set(i.stem for i in index.changed)
+skipped = 0
+
 oldver = {}
-for i in [Path(j) for j in sys.argv[1:]] if len(sys.argv) > 1 else Path("config").rglob("*.yaml"):
-    if i.stem in ["example"]:
+for i, config in configs:
+    if i.stem in ["example"] or not in_shard(i.stem, args.shard):
+        continue
+    if schedule is not None and i.stem not in changed and not schedule.is_due(i.stem):
+        skipped += 1
         continue
     try:
-        with open(i) as f:
-            config = yaml.safe_load(f)
-            if 'oldver' in config:
-                oldver[i.stem] = str(config['oldver'])
-            config = config["nvchecker"]
-            config["user_agent"] = "nvchecker"
-            nvchecker_toml[i.stem] = config
-        print("Loaded", i)
+        if 'oldver' in config:
+            oldver[i.stem] = str(config['oldver'])
+        config = dict(config["nvchecker"])
+        config["user_agent"] = "nvchecker"
+        # plugins/nvchecker_source 下的源，需要 PYTHONPATH=plugins
+        if config.get("source") == "regex" and "post_data" not in config:
+            config["source"] = "cached_regex"
+        elif config.get("source") == "github":
+            config["source"] = "github_graphql"
+        nvchecker_toml[i.stem] = config
     except:
         print("Failed to load", i)
         traceback.print_exc()
 
-with open("nvchecker.toml", "w") as f:
-    toml.dump(nvchecker_toml, f)
+if schedule is not None:
+    print(f"Scheduled {len(nvchecker_toml) - 1} packages, {skipped} are not due yet.")
 
-with open("oldver.json", "w") as f:
-    json.dump(oldver, f)
+write_if_changed("nvchecker.toml", toml.dumps(nvchecker_toml))
+write_if_changed("oldver.json", json.dumps(oldver))
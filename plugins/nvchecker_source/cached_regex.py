@@ -0,0 +1,148 @@
+"""
+The regex source of nvchecker with a persistent conditional-GET cache.
+
+nvchecker.py rewrites `source: regex` entries without post_data to this
+source; the options are the same.  The ETag/Last-Modified validators, the
+body and the versions extracted from it are kept per URL in
+NVCHECKER_HTTP_CACHE (default: $XDG_CACHE_HOME/aur-auto-update/http), so an
+unchanged page costs a 304 and no regex search.  The hit/miss counts are
+printed to stderr when nvchecker exits.
+"""
+
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import re
+import sys
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from nvchecker.api import session, GetVersionError
+from nvchecker.ctxvars import proxy, user_agent
+
+CACHE_DIR = Path(os.environ.get('NVCHECKER_HTTP_CACHE') or
+                 Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'aur-auto-update' / 'http')
+
+stats = {'hit': 0, 'miss': 0, 'new': 0}
+# 条件请求在线程里发出，限制并发和 nvchecker 默认的 concurrency 一致
+revalidations = asyncio.Semaphore(20)
+TIMEOUT = 20
+
+
+def print_stats():
+    if any(stats.values()):
+        print(f"cached_regex: {stats['hit']} not modified, {stats['miss']} modified, {stats['new']} not cached.", file=sys.stderr)
+
+
+atexit.register(print_stats)
+
+
+def write_atomic(path, data):
+    # 分片时会有多个 nvchecker 进程同时写缓存
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def conditional_get(url, headers):
+    """Return (status, headers, body); unlike nvchecker's Response this keeps the status code."""
+    handlers = [urllib.request.ProxyHandler({'http': proxy.get(), 'https': proxy.get()})] if proxy.get() else []
+    request = urllib.request.Request(url, headers={'User-Agent': user_agent.get(), **headers})
+    try:
+        with urllib.request.build_opener(*handlers).open(request, timeout=TIMEOUT) as res:
+            return res.status, res.headers, res.read()
+    except urllib.error.HTTPError as e:
+        # urllib 把 304 当作错误抛出
+        if e.code == 304:
+            return e.code, e.headers, b''
+        raise
+
+
+class CachedPage:
+
+    def __init__(self, url, encoding):
+        digest = hashlib.sha256(f'{url}\n{encoding}'.encode()).hexdigest()
+        self.meta_path = CACHE_DIR / f'{digest}.json'
+        self.body_path = CACHE_DIR / f'{digest}.body'
+        self.url = url
+        self.encoding = encoding
+        try:
+            self.meta = json.loads(self.meta_path.read_text())
+            self.body = self.body_path.read_bytes().decode(encoding)
+        except (FileNotFoundError, ValueError):
+            self.meta = None
+            self.body = None
+
+    def validators(self):
+        headers = {}
+        if self.meta is not None:
+            if self.meta.get('etag'):
+                headers['If-None-Match'] = self.meta['etag']
+            if self.meta.get('last_modified'):
+                headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+    async def fetch(self):
+        """Return True if the cached body is still valid."""
+        headers = self.validators()
+        if headers:
+            # nvchecker 的 Response 没有状态码，条件请求单独发出以便确认是 304
+            try:
+                async with revalidations:
+                    status, res_headers, body = await asyncio.to_thread(conditional_get, self.url, headers)
+            except (urllib.error.URLError, OSError) as e:
+                raise GetVersionError('failed to revalidate the cached page', url=self.url, exc_info=e)
+            if status == 304:
+                stats['hit'] += 1
+                return True
+        else:
+            res = await session.get(self.url)
+            res_headers, body = res.headers, res.body
+        stats['miss' if headers else 'new'] += 1
+        self.body = body.decode(self.encoding)
+        self.meta = {
+            'url': self.url,
+            'etag': res_headers.get('ETag'),
+            'last_modified': res_headers.get('Last-Modified'),
+            'versions': {},
+        }
+        if self.meta['etag'] or self.meta['last_modified']:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            write_atomic(self.body_path, body)
+            self.save()
+        return False
+
+    def save(self):
+        if self.body_path.exists():
+            write_atomic(self.meta_path, json.dumps(self.meta).encode())
+
+
+async def get_page(key):
+    url, encoding = key
+    page = CachedPage(url, encoding)
+    await page.fetch()
+    return page
+
+
+async def get_version(name, conf, *, cache, **kwargs):
+    try:
+        regex = re.compile(conf['regex'])
+    except re.error as e:
+        raise GetVersionError('bad regex', exc_info=e)
+    if regex.groups > 1:
+        raise GetVersionError('multi-group regex')
+
+    page = await cache.get(('cached_regex', conf['url'], conf.get('encoding', 'latin1')),
+                           lambda key: get_page(key[1:]))
+
+    versions = page.meta['versions'].get(regex.pattern)
+    if versions is None:
+        versions = regex.findall(page.body)
+        page.meta['versions'][regex.pattern] = versions
+        page.save()
+    if not versions and not conf.get('missing_ok', False):
+        raise GetVersionError('version string not found.')
+    return versions
@@ -0,0 +1,213 @@
+"""
+The github source of nvchecker, resolved with batched GraphQL queries.
+
+nvchecker.py rewrites `source: github` entries to this source.  Entries
+using use_latest_release, use_latest_tag, use_max_tag or the default
+latest commit are resolved for up to BATCH_SIZE repositories per query;
+the results have the same shape as the stock github source, so prefix,
+include_regex and the other list options still apply in nvchecker.
+Entries with options this source does not handle, or without a token,
+fall back to the stock github source.
+"""
+
+import asyncio
+import json
+
+from nvchecker.api import BaseWorker, GetVersionError, HTTPError, RawResult, RichResult, session
+from nvchecker.util import FunctionWorker
+from nvchecker_source import github
+
+BATCH_SIZE = 100
+GRAPHQL_URL = 'https://api.%s/graphql'
+UNSUPPORTED = ['use_max_release', 'include_prereleases', 'token']
+
+TAG_FIELDS = '''
+pageInfo { hasNextPage endCursor }
+nodes {
+  name
+  target {
+    __typename
+    oid
+    ... on Commit { committedDate }
+    ... on Tag { tagger { date } }
+  }
+}
+'''
+COMMIT_FIELDS = 'history(first: 1%s) { nodes { oid committedDate url } }'
+
+
+def mode(conf):
+    if conf.get('use_latest_tag'):
+        return 'latest_tag'
+    if conf.get('use_latest_release'):
+        return 'latest_release'
+    if conf.get('use_max_tag'):
+        return 'max_tag'
+    return 'commit'
+
+
+def batch_key(conf):
+    """Entries with the same key share one result."""
+    return (mode(conf), conf['github'], conf.get('query', ''), conf.get('branch'), conf.get('path'))
+
+
+def field(key, cursor=None):
+    kind, repo, query, branch, path = key
+    if kind == 'latest_release':
+        return 'latestRelease { name tagName url publishedAt }'
+    if kind == 'latest_tag':
+        return ('refs(refPrefix: "refs/tags/", first: 1, query: %s, '
+                'orderBy: {field: TAG_COMMIT_DATE, direction: DESC}) { %s }') % (json.dumps(query), TAG_FIELDS)
+    if kind == 'max_tag':
+        after = f', after: {json.dumps(cursor)}' if cursor else ''
+        return 'refs(refPrefix: "refs/tags/", first: 100%s) { %s }' % (after, TAG_FIELDS)
+    history = COMMIT_FIELDS % (f', path: {json.dumps(path)}' if path else '')
+    ref = f'ref(qualifiedName: {json.dumps("refs/heads/" + branch)})' if branch else 'defaultBranchRef'
+    return '%s { target { ... on Commit { %s } } }' % (ref, history)
+
+
+def build_query(items):
+    parts = []
+    for i, (key, cursor) in enumerate(items):
+        owner, name = key[1].split('/')
+        parts.append(f'r{i}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{ {field(key, cursor)} }}')
+    return '{\n%s\n}' % '\n'.join(parts)
+
+
+def tag_result(repo, node):
+    target = node['target']
+    if target['__typename'] == 'Commit':
+        revision_creation_time = target.get('committedDate')
+    elif target['__typename'] == 'Tag':
+        tagger = target.get('tagger')
+        revision_creation_time = tagger.get('date') if tagger is not None else None
+    else:
+        revision_creation_time = None
+    return RichResult(
+        version=node['name'],
+        gitref=f"refs/tags/{node['name']}",
+        revision=target['oid'],
+        url=f"https://github.com/{repo}/releases/tag/{node['name']}",
+        revision_creation_time=revision_creation_time,
+    )
+
+
+def parse_result(key, data, use_release_name):
+    kind, repo = key[:2]
+    if data is None:
+        raise GetVersionError('repository not found', repo=repo)
+    if kind == 'latest_release':
+        release = data['latestRelease']
+        if release is None:
+            raise GetVersionError('No release found in upstream repository.')
+        return RichResult(
+            version=release['name'] if use_release_name else release['tagName'],
+            gitref=f"refs/tags/{release['tagName']}",
+            url=release['url'],
+            creation_time=release.get('publishedAt'),
+        )
+    if kind == 'latest_tag':
+        nodes = data['refs']['nodes']
+        if not nodes:
+            raise GetVersionError('no tag found')
+        return tag_result(repo, nodes[0])
+    if kind == 'max_tag':
+        tags = [tag_result(repo, node) for node in data['refs']['nodes']]
+        if not tags:
+            raise GetVersionError('No tag found in upstream repository.')
+        return tags
+    ref = data['ref' if key[3] else 'defaultBranchRef']
+    commits = ref and ref['target'] and ref['target']['history']['nodes']
+    if not commits:
+        raise GetVersionError('no commit found', branch=key[3], path=key[4])
+    date = commits[0]['committedDate']
+    return RichResult(
+        # YYYYMMDD.HHMMSS，与原 github 源一致
+        version=date.rstrip('Z').replace('-', '').replace(':', '').replace('T', '.'),
+        revision=commits[0]['oid'],
+        revision_creation_time=date,
+        url=commits[0]['url'],
+    )
+
+
+class Worker(BaseWorker):
+
+    async def run(self):
+        groups = {}
+        fallback = []
+        for name, conf in self.tasks:
+            host = conf.get('host', 'github.com')
+            token = self.keymanager.get_key(host.lower(), 'github')
+            if token is None or any(conf.get(option) for option in UNSUPPORTED):
+                fallback.append((name, conf))
+            else:
+                groups.setdefault((host, token), []).append((name, conf))
+
+        futures = [self.run_group(host, token, tasks) for (host, token), tasks in groups.items()]
+        if fallback:
+            worker = FunctionWorker(self.task_sem, self.result_q, fallback, self.keymanager)
+            worker.initialize(github.get_version)
+            futures.append(worker.run())
+        await asyncio.gather(*futures)
+
+    async def query(self, host, token, items):
+        headers = {
+            'Authorization': f'bearer {token}',
+            'Content-Type': 'application/json',
+        }
+        for _ in range(2):
+            try:
+                async with self.task_sem:
+                    res = await session.post(GRAPHQL_URL % host, headers=headers, json={'query': build_query(items)})
+                break
+            except HTTPError as e:
+                # 与原 github 源相同的限速处理，只等待一次
+                if e.code in [403, 429] and (n := github.check_ratelimit(e, 'github_graphql')):
+                    await asyncio.sleep(n + 1)
+                    continue
+                raise
+        j = res.json()
+        data = j.get('data') or {}
+        if not data and j.get('errors'):
+            raise GetVersionError('GraphQL query failed', errors=j['errors'])
+        return [data.get(f'r{i}') for i in range(len(items))]
+
+    async def run_batch(self, host, token, keys):
+        """Resolve the raw repository data of keys, following the pages of max_tag refs."""
+        results = {}
+        pending = [(key, None) for key in keys]
+        while pending:
+            items, pending = pending, []
+            for data, (key, cursor) in zip(await self.query(host, token, items), items):
+                if data is None:
+                    results[key] = None
+                    continue
+                if key not in results:
+                    results[key] = data
+                elif data.get('refs'):
+                    results[key]['refs']['nodes'].extend(data['refs']['nodes'])
+                if key[0] == 'max_tag' and data['refs']['pageInfo']['hasNextPage']:
+                    pending.append((key, data['refs']['pageInfo']['endCursor']))
+        return results
+
+    async def run_group(self, host, token, tasks):
+        entries = {}
+        for name, conf in tasks:
+            entries.setdefault(batch_key(conf), []).append((name, conf))
+        keys = list(entries)
+        for i in range(0, len(keys), BATCH_SIZE):
+            batch = keys[i:i + BATCH_SIZE]
+            try:
+                results = await self.run_batch(host, token, batch)
+            except Exception as e:
+                for key in batch:
+                    for name, conf in entries[key]:
+                        await self.result_q.put(RawResult(name, e, conf))
+                continue
+            for key in batch:
+                for name, conf in entries[key]:
+                    try:
+                        version = parse_result(key, results.get(key), conf.get('use_release_name', False))
+                    except Exception as e:
+                        version = e
+                    await self.result_q.put(RawResult(name, version, conf))
@@ -1,72 +1,341 @@
 #!/bin/python
+"""
+Act on the updates found by nvchecker.
+
+Usage:
+    process-update.py [nvchecker.log]         # process a finished log
+    process-update.py -                       # stream the JSON log from stdin
+    process-update.py --follow nvchecker.log  # follow a log that is still growing
+    process-update.py --build-batch 10        # build up to 10 packages per build-batch.yml run
+"""
+
+import argparse
 import json
 import logging
 import os
-import requests
+import select
 import sys
+import time
+import threading
 import traceback
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 import toml
-import yaml
 from github import Github
 
-token = toml.load("config/keyfile.toml")["keys"]["github.com"]
-github = Github(token)
-session = requests.Session()
+from aur import AUR, PAGE_CACHE_PATH
+from check_schedule import ReleaseHistory
+from config_index import ConfigIndex
+from dispatch import Dispatcher
+from ledger import DispatchLedger, config_hash
+from vercmp import parse_evr, vercmp
+from yaml_update import set_keys
 
-with open("nvchecker.log") as f:
-    lines = f.readlines()
+# 标记过期使用同一个登录会话，限制并发和请求间隔，避免给 AUR 造成压力
+FLAG_WORKERS = 2
+FLAG_INTERVAL = 2
 
-nvtake = []
-for line in lines:
-    try:
-        data = json.loads(line.strip("\n"))
-    except json.JSONDecodeError:
-        # 非 JSON 行（例如 nvchecker 的人类可读输出），跳过
-        continue
-    
-    if not 'name' in data:
-        print(f"Failed to process update for {data}.")
-        continue
-    
-    package = data["name"]
-    event = data.get("event", "")
-    
-    if event in ["running cmd"]:
-        continue
-    
-    if event == "updated":
-        version = data["version"]
+def read_lines(f, follow=False, idle=5, timeout=600):
+    """Yield lines as soon as they arrive, or None when nothing arrived for `idle` seconds."""
+    fd = f.fileno()
+    buffer = b''
+    last = time.monotonic()
+    while True:
+        ready, _, _ = select.select([fd], [], [], idle)
+        chunk = os.read(fd, 65536) if ready else None
+        if chunk == b'':
+            if not follow or time.monotonic() - last > timeout:
+                break
+            yield None
+            time.sleep(idle)
+            continue
+        if chunk is None:
+            yield None
+            continue
+        last = time.monotonic()
+        *lines, buffer = (buffer + chunk).split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8', 'replace')
+    if buffer:
+        yield buffer.decode('utf-8', 'replace')
+
+def read_events(f, follow=False):
+    for line in read_lines(f, follow):
+        if line is None:
+            yield None
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            # 非 JSON 行（例如 nvchecker 的人类可读输出），跳过
+            continue
+
+class UpdateProcessor:
+
+    def __init__(self, batch_size=20, max_delay=10, build_batch=1):
+        token = toml.load("config/keyfile.toml")["keys"]["github.com"]
+        # Dispatcher 自己处理重试和限速，这里只放宽 PyGithub 默认的串行写入间隔
+        github = Github(token, pool_size=8, retry=None, seconds_between_writes=0.2)
+        self.aur = AUR(cache=PAGE_CACHE_PATH)
+        self.index = ConfigIndex()
+        self.dispatcher = Dispatcher(github, 'arch4edu/aur-auto-update', 'build.yml')
+        self.batch_dispatcher = Dispatcher(github, 'arch4edu/aur-auto-update', 'build-batch.yml')
+        self.build_batch = build_batch
+        self.build_queue = {}
+        self.batch_count = 0
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.pending = []
+        self.pending_since = None
+        self.aur_info = {}
+        self.aur_pkgbases = {}
+        self.nvtake = []
+        self.flag_queue = []
+        self.flag_lock = threading.Lock()
+        self.next_flag = 0
+        self.history = ReleaseHistory()
+        self.ledger = DispatchLedger()
+        self.dispatches = []
+        try:
+            resolved = self.ledger.refresh(self.dispatcher.workflow)
+            resolved += self.ledger.refresh_batches(self.batch_dispatcher.workflow, token)
+            print(f"Resolved {resolved} pending build tests in the dispatch ledger.")
+        except:
+            print("Failed to refresh the dispatch ledger.")
+            traceback.print_exc()
+
+    def exists_on_aur(self, package):
+        if package in self.aur_info or package in self.aur_pkgbases:
+            return True
+        # pkgbase 不一定是某个 pkgname（拆分包），此时回退到 pkgbase 页面
+        return self.aur.get_pkgbase(package) is not None
+
+    def flush(self):
+        """Resolve the pending updated packages with one batched AUR query and act on them."""
+        if not self.pending:
+            return
+        names = [data["name"] for data in self.pending]
         try:
-            config = next(Path("config").rglob(f"{package}.yaml"))
-            with open(config) as f:
-                config = yaml.safe_load(f)
+            info = self.aur.info(names)
+        except:
+            print("Failed to query AUR RPC, falling back to per-package checks.")
+            traceback.print_exc()
+            info = {}
+        self.aur_info.update(info)
+        self.aur_pkgbases.update((i.pkgbase, i) for i in info.values())
+        print(f"Resolved {len(info)} of {len(names)} updated packages with AUR RPC.")
+
+        pending, self.pending = self.pending, []
+        for data in pending:
+            self.process_updated(data["name"], data["version"])
+
+    def check_version(self, package_config, version):
+        """Return why version is not an update, before a build test finds out in bin/update-pkgver."""
+        oldver = package_config.get("oldver")
+        if oldver is not None and vercmp(version, str(oldver)) <= 0:
+            return f"it is not newer than oldver {oldver}"
+        info = self.aur_info.get(package_config.name)
+        # override 脚本可能会改写版本号，此时无法和 AUR 上的 pkgver 比较
+        if info is not None and info.version and package_config.override is None:
+            _, pkgver, _ = parse_evr(info.version)
+            if vercmp(version, pkgver) < 0:
+                return f"it is older than the AUR version {info.version}"
+        return None
+
+    def process_updated(self, package, version):
+        try:
+            package_config = self.index[package]
+            config = package_config.config
             flag = False if not "flag" in config else config["flag"]
             test = True if not "test" in config else config["test"]
-            if session.get(f'https://aur.archlinux.org/pkgbase/{package}').status_code == 404:
+            fast = False if not "fast-update" in config else config["fast-update"]
+            if not self.exists_on_aur(package):
                 print(f"{package} doesn't exist on AUR.")
-                continue
-            if test:
+                return
+            reason = self.check_version(package_config, version)
+            if reason is not None:
+                print(f"Skipped {package} {version}: {reason}.")
+                return
+            # 只记录被接受的新版本，避免被拒绝的版本影响检查间隔
+            self.history.record_release(package, version)
+            if fast:
+                # 只改写版本号和校验和的包不需要 Arch 容器和构建测试
+                digest = config_hash(package_config)
+                reason = self.ledger.skip_reason(package, version, digest)
+                if reason is not None:
+                    print(f"Skipped fast update for {package} {version}: {reason}.")
+                    return
+                future = self.dispatcher.submit({'pkgbase': package, 'pkgver': version, 'fast-update': 'true'}, f"fast update for {package} {version}")
+                self.dispatches.append((package, version, digest, future, None))
+            elif test:
+                digest = config_hash(package_config)
+                reason = self.ledger.skip_reason(package, version, digest)
+                if reason is not None:
+                    print(f"Skipped build test for {package} {version}: {reason}.")
+                    return
                 clean = 'false' if not "clean-up-ubuntu" in config else config["clean-up-ubuntu"]
-                github.get_repo('arch4edu/aur-auto-update').get_workflow("build.yml").create_dispatch('main', {'pkgbase': package, 'pkgver': version, 'clean-up-ubuntu': clean})
-                print(f"Triggered build test for {package} {version}.")
+                if self.build_batch > 1:
+                    self.queue_build(package, version, digest, clean)
+                    return
+                future = self.dispatcher.submit({'pkgbase': package, 'pkgver': version, 'clean-up-ubuntu': clean}, f"build test for {package} {version}")
+                self.dispatches.append((package, version, digest, future, None))
             elif flag:
-                print(f"TODO: Flag {package} on AUR.")
-                # TODO: Flag the package on AUR
-                # nvtake.append(package)
+                self.flag_queue.append((package, version))
+                print(f"Queued flagging {package} {version} on AUR.")
             else:
                 print(f"No action is configured for {package}.")
                 # TODO: Comment the error to AUR
         except:
             print(f"Failed to process update for {package}.")
             traceback.print_exc()
-    elif event == "up-to-date":
-        # 包是最新的，无需操作
-        pass
-    else:
-        # 其他事件（如 error、warning 等）视为失败，记录事件类型
-        print(f"Failed to check update for {package}: event={event}.")
-
-with open("nvtake.txt", "w") as f:
-    f.write(" ".join(nvtake))
+
+    def queue_build(self, package, version, digest, clean):
+        # 需要清理 ubuntu 的包单独成批，其余的包不用付出清理的时间
+        queue = self.build_queue.setdefault(str(clean).lower(), [])
+        queue.append((package, version, digest))
+        print(f"Queued build test for {package} {version}.")
+        if len(queue) >= self.build_batch:
+            self.dispatch_batch(str(clean).lower())
+
+    def dispatch_batch(self, clean):
+        builds = self.build_queue.pop(clean)
+        self.batch_count += 1
+        batch = f"{time.strftime('%Y%m%d%H%M%S')}-{self.batch_count}"
+        packages = json.dumps([{'pkgbase': package, 'pkgver': version} for package, version, _ in builds])
+        # 日志中列出每个包，log_classifier.py 据此统计派发的构建
+        description = f"build batch {batch} with {len(builds)} packages: " + ', '.join(f"{package} {version}" for package, version, _ in builds)
+        future = self.batch_dispatcher.submit({'batch': batch, 'packages': packages, 'clean-up-ubuntu': clean}, description)
+        self.dispatches.extend((package, version, digest, future, batch) for package, version, digest in builds)
+
+    def package_info(self, package):
+        """Return the AUR info of a pkgname or pkgbase, or None."""
+        info = self.aur_info.get(package) or self.aur_pkgbases.get(package)
+        if info is not None:
+            return info
+        # 只配置了 pkgbase 的拆分包按 pkgname 查不到，按名字搜索后再比较 pkgbase
+        try:
+            return next((i for i in self.aur.search('name', package) if i.pkgbase == package), None)
+        except:
+            print(f"Failed to look up {package} on AUR.")
+            traceback.print_exc()
+            return None
+
+    def flag_one(self, aur, package, version):
+        try:
+            info = self.package_info(package)
+            if info is not None and info.out_of_date:
+                out_of_date = info.out_of_date
+                print(f"{package} is already flagged on AUR.")
+            else:
+                with self.flag_lock:
+                    wait = self.next_flag - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                    self.next_flag = time.monotonic() + FLAG_INTERVAL
+                aur.flag(package, f"New version {version} is available.")
+                out_of_date = int(time.time())
+                print(f"Flagged {package} {version} on AUR.")
+            # 和构建推送后一样更新 oldver，out_of_date 与 AUR 的 OutOfDate 对应
+            set_keys(self.index[package].path, {'out_of_date': out_of_date, 'oldver': version})
+            return True
+        except:
+            print(f"Failed to flag {package} on AUR.")
+            traceback.print_exc()
+            return False
+
+    def flag_packages(self):
+        """Flag all queued packages in one logged-in AUR session."""
+        if not self.flag_queue:
+            return
+        username = os.environ.get("AUR_USERNAME")
+        password = os.environ.get("AUR_PASSWORD")
+        if not username or not password:
+            print(f"AUR_USERNAME and AUR_PASSWORD are not set, not flagging {len(self.flag_queue)} packages.")
+            return
+        aur = AUR(username, password)
+        try:
+            aur.login()
+        except:
+            print("Failed to log in to AUR.")
+            traceback.print_exc()
+            return
+        with ThreadPoolExecutor(max_workers=FLAG_WORKERS) as executor:
+            results = list(executor.map(lambda i: self.flag_one(aur, *i), self.flag_queue))
+        flagged = [package for (package, _), ok in zip(self.flag_queue, results) if ok]
+        self.nvtake.extend(flagged)
+        print(f"Flagged {len(flagged)} of {len(self.flag_queue)} packages on AUR.")
+
+    def process(self, data):
+        if data is None:
+            # 输入暂时没有新内容，先处理已经积累的更新
+            self.flush()
+            return
+        # 每个事件都检查等待时间，避免更新被一串 up-to-date 事件一直压着
+        if self.pending and time.monotonic() - self.pending_since > self.max_delay:
+            self.flush()
+
+        if not 'name' in data:
+            print(f"Failed to process update for {data}.")
+            return
+
+        package = data["name"]
+        event = data.get("event", "")
+
+        if event in ["running cmd"]:
+            return
+
+        if event == "updated":
+            # 发布要等 check_version 接受后才记录，这里只记录检查时间
+            self.history.record_check(package)
+            if not self.pending:
+                self.pending_since = time.monotonic()
+            self.pending.append(data)
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+        elif event == "up-to-date":
+            # 包是最新的，只记录检查时间供调度使用
+            self.history.record_check(package, data.get("version"))
+        else:
+            # 其他事件（如 error、warning 等）视为失败，记录事件类型
+            print(f"Failed to check update for {package}: event={event}.")
+
+    def close(self):
+        self.flush()
+        self.flag_packages()
+        for clean in list(self.build_queue):
+            self.dispatch_batch(clean)
+        self.dispatcher.close()
+        self.batch_dispatcher.close()
+        self.history.save()
+        self.aur.save_cache()
+        # 只记录真正派发成功的构建
+        for package, version, digest, future, batch in self.dispatches:
+            if future.result():
+                self.ledger.record_dispatch(package, version, digest, batch)
+        self.ledger.save()
+        with open("nvtake.txt", "w") as f:
+            f.write(" ".join(self.nvtake))
+
+def main():
+    parser = argparse.ArgumentParser(description='Act on the updates found by nvchecker.')
+    parser.add_argument('log', nargs='?', default='nvchecker.log', help="nvchecker JSON log, '-' for stdin")
+    parser.add_argument('--follow', action='store_true', help='keep reading the log while it grows')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='number of updated packages resolved per AUR query (default: 20 when streaming, all otherwise)')
+    parser.add_argument('--build-batch', type=int, default=1,
+                        help='number of packages built by one build-batch.yml run (default: one build.yml run per package)')
+    args = parser.parse_args()
+
+    streaming = args.log == '-' or args.follow
+    batch_size = args.batch_size or (20 if streaming else sys.maxsize)
+    processor = UpdateProcessor(batch_size, 10 if streaming else float('inf'), args.build_batch)
+
+    f = sys.stdin if args.log == '-' else open(args.log, 'rb')
+    try:
+        for data in read_events(f, args.follow):
+            processor.process(data)
+    finally:
+        processor.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/bin/python
+"""
+Run nvchecker over nvchecker.toml in shards grouped by upstream host.
+
+Usage:
+    run-nvchecker.py [-c nvchecker.toml] [--workers N] [--per-host N] [--shard-size N]
+
+Every shard is a separate nvchecker process.  Shards of different hosts run
+concurrently while each host only gets --per-host shards at a time.  The JSON
+logs of all shards are written to stdout as soon as they arrive, in the same
+format as `nvchecker --logger both`, and the newver files of the shards are
+merged into the configured newver file at the end.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+import toml
+
+from verfile import read_verfile, write_verfile
+
+SOURCE_HOSTS = {
+    'github': 'api.github.com',
+    'github_graphql': 'api.github.com',
+    'pypi': 'pypi.org',
+    'npm': 'registry.npmjs.org',
+    'cran': 'cran.r-project.org',
+    'aur': 'aur.archlinux.org',
+    'archpkg': 'archlinux.org',
+}
+URL_KEYS = ['url', 'git']
+
+def get_host(entry):
+    source = entry.get('source', '')
+    if source == 'gitlab':
+        return entry.get('host', 'gitlab.com')
+    if source in SOURCE_HOSTS:
+        return SOURCE_HOSTS[source]
+    for key in URL_KEYS:
+        if key in entry:
+            return urlparse(entry[key]).hostname or source
+    return source
+
+def make_shards(config, shard_size):
+    groups = defaultdict(list)
+    for name, entry in config.items():
+        if name == '__config__':
+            continue
+        groups[get_host(entry)].append(name)
+    chunks = [[(host, names[i:i + shard_size]) for i in range(0, len(names), shard_size)]
+              for host, names in sorted(groups.items(), key=lambda i: -len(i[1]))]
+    # 按主机轮流排列，避免所有 worker 同时等待同一个主机
+    shards = []
+    for i in range(max((len(c) for c in chunks), default=0)):
+        shards.extend(c[i] for c in chunks if i < len(c))
+    return shards
+
+class ShardRunner:
+
+    def __init__(self, config_file, workers, per_host, shard_concurrency):
+        self.config_file = Path(config_file).resolve()
+        self.config = toml.load(self.config_file)
+        self.global_config = self.config.get('__config__', {})
+        self.workers = workers
+        self.per_host = per_host
+        self.shard_concurrency = shard_concurrency
+        self.host_locks = defaultdict(lambda: threading.Semaphore(per_host))
+        self.output_lock = threading.Lock()
+        self.tmpdir = tempfile.TemporaryDirectory(prefix='nvchecker-shards-')
+        self.failed = []
+
+    def resolve(self, key):
+        # nvchecker 把这些路径解析为相对于配置文件所在的目录
+        value = self.global_config.get(key)
+        if value is None:
+            return None
+        return str(self.config_file.parent / os.path.expandvars(os.path.expanduser(value)))
+
+    def write_shard_config(self, index, names):
+        shard_config = dict(self.global_config)
+        for key in ['oldver', 'keyfile']:
+            if key in shard_config:
+                shard_config[key] = self.resolve(key)
+        shard_config['newver'] = os.path.join(self.tmpdir.name, f'newver-{index}.json')
+        shard_config['max_concurrency'] = self.shard_concurrency
+        config = {'__config__': shard_config}
+        for name in names:
+            config[name] = self.config[name]
+        path = os.path.join(self.tmpdir.name, f'shard-{index}.toml')
+        with open(path, 'w') as f:
+            toml.dump(config, f)
+        return path
+
+    def run_shard(self, index, host, names):
+        path = self.write_shard_config(index, names)
+        with self.host_locks[host]:
+            start = time.monotonic()
+            proc = subprocess.Popen(['nvchecker', '--logger', 'both', '-c', path], stdout=subprocess.PIPE, text=True)
+            for line in proc.stdout:
+                with self.output_lock:
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+            proc.wait()
+        elapsed = time.monotonic() - start
+        print(f"Shard {index} ({host}, {len(names)} entries) finished in {elapsed:.1f}s with exit code {proc.returncode}.", file=sys.stderr)
+        if proc.returncode != 0:
+            self.failed.append(index)
+
+    def merge_newver(self, shards):
+        newver = self.resolve('newver')
+        if newver is None:
+            return
+        versions = read_verfile(newver)
+        for index in range(len(shards)):
+            versions.update(read_verfile(os.path.join(self.tmpdir.name, f'newver-{index}.json')))
+        write_verfile(newver, versions)
+
+    def run(self, shard_size):
+        shards = make_shards(self.config, shard_size)
+        hosts = len(set(host for host, _ in shards))
+        print(f"Running {len(shards)} nvchecker shards for {hosts} hosts.", file=sys.stderr)
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for future in [executor.submit(self.run_shard, index, host, names) for index, (host, names) in enumerate(shards)]:
+                future.result()
+        self.merge_newver(shards)
+        self.tmpdir.cleanup()
+        print(f"Checked {len(self.config) - 1} entries in {time.monotonic() - start:.1f}s, {len(self.failed)} shards failed.", file=sys.stderr)
+        return 1 if self.failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Run nvchecker in shards grouped by upstream host.')
+    parser.add_argument('-c', '--config', default='nvchecker.toml')
+    parser.add_argument('--workers', type=int, default=8, help='number of nvchecker processes running at the same time')
+    parser.add_argument('--per-host', type=int, default=2, help='number of shards of the same host running at the same time')
+    parser.add_argument('--shard-size', type=int, default=50, help='maximum number of entries per shard')
+    parser.add_argument('--shard-concurrency', type=int, default=5, help='max_concurrency of each nvchecker process')
+    args = parser.parse_args()
+
+    runner = ShardRunner(args.config, args.workers, args.per_host, args.shard_concurrency)
+    return runner.run(args.shard_size)
+
+if __name__ == '__main__':
+    sys.exit(main())
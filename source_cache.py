@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of the upstream sources of the packages.
+
+Usage:
+    source_cache.py restore <pkgbase> <pkgver> [directory]
+    source_cache.py store <pkgbase> <pkgver> [directory]
+    source_cache.py show
+    source_cache.py key
+    source_cache.py prune [--max-size SIZE]
+
+Files are stored once under objects/<sha256> and indexed by their URL.
+`store` adds the remote sources of a built package whose content matches
+the checksums in its PKGBUILD; `restore` puts the cached files of a
+package back under the names makepkg uses, so a rerun of the same version
+does not download them again.  Only files whose URL contains the pkgver
+are restored, since an unversioned URL may point to new content, so
+`store` drops the files of the other versions of the package.  The least
+recently used files are evicted when the cache grows over its size cap,
+except those of the version just stored, which may be larger than the cap.  The cache lives in $SOURCE_CACHE (default: source-cache next to this
+script) and is kept in the actions cache by the workflows, which only save
+it under a new `key` when its contents changed.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+INDEX_NAME = 'index.json'
+# 每个包一个 actions 缓存，仓库的缓存总共只有 10 GB，还要放 aur-mirror 等
+DEFAULT_MAX_SIZE = 512 << 20
+CHUNK_SIZE = 1 << 20
+HASHES = {
+    'md5': hashlib.md5,
+    'sha1': hashlib.sha1,
+    'sha224': hashlib.sha224,
+    'sha256': hashlib.sha256,
+    'sha384': hashlib.sha384,
+    'sha512': hashlib.sha512,
+    'b2': hashlib.blake2b,
+}
+VCS_PREFIXES = ('git+', 'git://', 'svn+', 'svn://', 'hg+', 'bzr+', 'fossil+')
+SIZE_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+# 在 bash 中读取 PKGBUILD，和 makepkg 一样展开 $pkgver、$CARCH 等变量
+DUMP_ARRAYS = r'''
+[ -f /etc/makepkg.conf ] && source /etc/makepkg.conf
+CARCH=${CARCH:-x86_64}
+CHOST=${CHOST:-$CARCH-pc-linux-gnu}
+startdir=$PWD
+srcdir=$startdir/src
+pkgdir=$startdir/pkg
+export CARCH CHOST startdir srcdir pkgdir
+source ./PKGBUILD
+for var in $(compgen -A variable); do
+    [[ $var =~ ^(source|(md5|sha1|sha224|sha256|sha384|sha512|b2|ck)sums)(_[A-Za-z0-9_]+)?$ ]] || continue
+    declare -n ref=$var
+    for value in "${ref[@]}"; do
+        printf '%s\t%s\n' "$var" "$value"
+    done
+    unset -n ref
+done
+'''
+
+
+def read_arrays(directory):
+    """Return the source and checksum arrays of a PKGBUILD, e.g. {'source_x86_64': [...], 'sha256sums': [...]}."""
+    output = subprocess.run(['bash', '-c', DUMP_ARRAYS], cwd=directory, capture_output=True, text=True, check=True).stdout
+    arrays = {}
+    for line in output.splitlines():
+        name, value = line.split('\t', 1)
+        arrays.setdefault(name, []).append(value)
+    return arrays
+
+
+def source_location(entry):
+    return entry.split('::', 1)[1] if '::' in entry else entry
+
+
+def source_filename(entry):
+    """Return the file name makepkg downloads a source entry to."""
+    if '::' in entry:
+        return entry.split('::', 1)[0]
+    return entry.split('#', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+
+
+def is_remote(entry):
+    location = source_location(entry)
+    return '://' in location and not location.startswith(VCS_PREFIXES)
+
+
+def hash_file(path, algorithms):
+    hashers = dict((algorithm, HASHES[algorithm]()) for algorithm in algorithms)
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            for hasher in hashers.values():
+                hasher.update(chunk)
+    return dict((algorithm, hasher.hexdigest()) for algorithm, hasher in hashers.items())
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip('IB')
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+class SourceCache:
+
+    def __init__(self, root=None, max_size=None):
+        self.root = Path(root or os.environ.get('SOURCE_CACHE') or Path(__file__).resolve().parent / 'source-cache')
+        self.max_size = max_size or parse_size(os.environ.get('SOURCE_CACHE_SIZE') or str(DEFAULT_MAX_SIZE))
+        self.objects = self.root / 'objects'
+        self.lock = threading.Lock()
+        try:
+            with open(self.root / INDEX_NAME) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f'{INDEX_NAME}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.root / INDEX_NAME)
+
+    def lookup(self, url):
+        """Return the cached file of a URL and mark it as used, or None."""
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            path = self.objects / entry['sha256']
+            if not path.exists():
+                del self.entries[url]
+                return None
+            entry['used'] = int(time.time())
+            return path
+
+    def add(self, url, path, pkgbase, filename, checksums=None, move=False):
+        """Add a file under the sha256 of its content; `checksums` are the known ones in PKGBUILD."""
+        checksums = dict(checksums or {})
+        digests = hash_file(path, set(checksums) | {'sha256'})
+        if any(digests[algorithm] != value for algorithm, value in checksums.items()):
+            return False
+        sha256 = digests['sha256']
+        with self.lock:
+            self.objects.mkdir(parents=True, exist_ok=True)
+            target = self.objects / sha256
+            if target.exists():
+                if move:
+                    os.unlink(path)
+            elif move:
+                os.replace(path, target)
+            else:
+                link_or_copy(path, target)
+            checksums['sha256'] = sha256
+            self.entries[url] = {'pkgbase': pkgbase, 'filename': filename, 'sha256': sha256,
+                                 'size': target.stat().st_size, 'checksums': checksums, 'used': int(time.time())}
+        return True
+
+    def download(self, url, pkgbase, filename, reuse=True):
+        """Return the cached file of a URL, downloading it into the cache first if needed or not `reuse`."""
+        path = self.lookup(url) if reuse else None
+        if path is not None:
+            return path
+        # 构建容器里只有 restore/store，不需要安装 requests
+        import requests
+        self.objects.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.objects, prefix='.download-')
+        try:
+            with os.fdopen(fd, 'wb') as f, requests.get(url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+            self.add(url, tmp, pkgbase, filename, move=True)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        return self.lookup(url)
+
+    def reusable(self, pkgbase, pkgver):
+        """Return the URLs of a package that can be reused for pkgver."""
+        # 不带版本号的地址（如 latest.tar.gz）的内容可能已经变了，不复用
+        with self.lock:
+            return [url for url, entry in self.entries.items() if entry['pkgbase'] == pkgbase and pkgver in url]
+
+    def discard_stale(self, pkgbase, pkgver):
+        """Drop the entries of a package that can't be reused for pkgver; return how many were dropped."""
+        with self.lock:
+            stale = [url for url, entry in self.entries.items() if entry['pkgbase'] == pkgbase and pkgver not in url]
+            for url in stale:
+                del self.entries[url]
+        return len(stale)
+
+    def restore(self, pkgbase, pkgver, directory):
+        """Put the cached sources of a package into its directory under their makepkg names."""
+        restored = 0
+        for url in self.reusable(pkgbase, pkgver):
+            target = Path(directory) / self.entries[url]['filename']
+            path = self.lookup(url)
+            if path is None or target.exists():
+                continue
+            link_or_copy(path, target)
+            restored += 1
+        return restored
+
+    def store(self, pkgbase, pkgver, directory):
+        """Add the downloaded remote sources of a package whose content matches its PKGBUILD checksums."""
+        directory = Path(directory)
+        arrays = read_arrays(directory)
+        # 旧版本的文件再也不会被 restore，只会占用空间
+        self.discard_stale(pkgbase, pkgver)
+        stored = 0
+        for name, sources in arrays.items():
+            if not name.startswith('source'):
+                continue
+            arch = name[len('source'):]
+            for i, entry in enumerate(sources):
+                path = directory / source_filename(entry)
+                if not is_remote(entry) or not path.is_file():
+                    continue
+                checksums = {}
+                for algorithm in HASHES:
+                    values = arrays.get(f'{algorithm}sums{arch}', [])
+                    if i < len(values) and values[i] != 'SKIP':
+                        checksums[algorithm] = values[i].lower()
+                url = source_location(entry)
+                if pkgver not in url:
+                    continue
+                if self.add(url, path, pkgbase, source_filename(entry), checksums):
+                    stored += 1
+                else:
+                    print(f"Not caching {url}: it doesn't match the checksums in PKGBUILD.")
+        return stored
+
+    def content_key(self):
+        """Return a digest of the cached contents, or '' when the cache is empty."""
+        objects = sorted(set(entry['sha256'] for entry in self.entries.values()))
+        return hashlib.sha256('\n'.join(objects).encode()).hexdigest()[:16] if objects else ''
+
+    def size(self):
+        sizes = dict((entry['sha256'], entry['size']) for entry in self.entries.values())
+        return sum(sizes.values())
+
+    def prune(self, max_size=None, keep=()):
+        """Evict the least recently used files except those of the URLs in keep until the cache fits in max_size; return the freed bytes."""
+        max_size = self.max_size if max_size is None else max_size
+        freed = 0
+        with self.lock:
+            kept = set(self.entries[url]['sha256'] for url in keep if url in self.entries)
+            # 同一内容可能对应多个地址，按对象最后一次使用的时间淘汰
+            used = {}
+            for entry in self.entries.values():
+                used[entry['sha256']] = max(used.get(entry['sha256'], 0), entry['used'])
+            sizes = dict((entry['sha256'], entry['size']) for entry in self.entries.values())
+            total = sum(sizes.values())
+            for sha256 in sorted(used, key=used.get):
+                if total <= max_size:
+                    break
+                if sha256 in kept:
+                    continue
+                total -= sizes[sha256]
+                freed += sizes[sha256]
+                self.entries = dict((url, entry) for url, entry in self.entries.items() if entry['sha256'] != sha256)
+            # 删除没有被索引引用的对象和中断的下载
+            referenced = set(entry['sha256'] for entry in self.entries.values())
+            if self.objects.exists():
+                for path in self.objects.iterdir():
+                    if path.name not in referenced:
+                        path.unlink()
+        return freed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the content-addressed cache of upstream sources.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    restore_parser = subparsers.add_parser('restore', help='put the cached sources of a package into its directory')
+    restore_parser.add_argument('pkgbase')
+    restore_parser.add_argument('pkgver')
+    restore_parser.add_argument('directory', nargs='?', default='.')
+    store_parser = subparsers.add_parser('store', help='add the downloaded sources of a package')
+    store_parser.add_argument('pkgbase')
+    store_parser.add_argument('pkgver')
+    store_parser.add_argument('directory', nargs='?', default='.')
+    subparsers.add_parser('show', help='print the cached files')
+    subparsers.add_parser('key', help='print a digest of the cached contents for the actions cache key')
+    prune_parser = subparsers.add_parser('prune', help='evict the least recently used files')
+    prune_parser.add_argument('--max-size', type=parse_size, help='e.g. 2G (default: $SOURCE_CACHE_SIZE or 512M)')
+    args = parser.parse_args()
+
+    cache = SourceCache()
+    if args.command == 'restore':
+        print(f"Restored {cache.restore(args.pkgbase, args.pkgver, args.directory)} cached sources of {args.pkgbase}.")
+    elif args.command == 'store':
+        print(f"Cached {cache.store(args.pkgbase, args.pkgver, args.directory)} sources of {args.pkgbase}.")
+        freed = cache.prune(keep=cache.reusable(args.pkgbase, args.pkgver))
+        if freed:
+            print(f"Evicted {freed >> 20} MiB from the source cache.")
+    elif args.command == 'show':
+        print(f"{'Package':<32} {'Size':>10}  {'Last used':<16}  URL")
+        for url, entry in sorted(cache.entries.items(), key=lambda i: -i[1]['used']):
+            used = time.strftime('%Y-%m-%d %H:%M', time.gmtime(entry['used']))
+            print(f"{entry['pkgbase']:<32} {entry['size'] >> 20:>7} MiB  {used:<16}  {url}")
+        print(f"Total: {cache.size() >> 20} MiB of {cache.max_size >> 20} MiB.")
+        return 0
+    elif args.command == 'key':
+        print(cache.content_key())
+        return 0
+    elif args.command == 'prune':
+        freed = cache.prune(args.max_size)
+        print(f"Evicted {freed >> 20} MiB, {cache.size() >> 20} MiB left in the source cache.")
+    cache.save()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#!/bin/python
+"""
+Write the oldver of pushed packages back to their YAML files in batches.
+
+Usage:
+    update-oldver.py queue <pkgbase> <pkgver>
+    update-oldver.py apply [--artifacts] [--commit] [queue file or directory...]
+
+The push jobs `queue` a bump as oldver-queue/<pkgbase>.json instead of
+committing and pushing every YAML on their own, and upload the queue as
+an oldver-queue artifact.  `apply` sets the oldver of all queued packages
+with yaml_update.set_keys, optionally collecting the queues from the
+oldver-queue artifacts of the recent workflow runs, and with --commit
+records all of them in one commit, so N pushed packages cost one push to
+main.  Bumps that are not newer than the current oldver are ignored, so
+applying the same queue again is harmless.  check-update.yml applies the
+queue in its prepare job, before the check shards read the oldver.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from config_index import ConfigIndex
+from vercmp import vercmp
+from yaml_update import set_keys
+
+QUEUE_DIR = 'oldver-queue'
+ARTIFACT_NAME = 'oldver-queue'
+# 和上传 artifact 时的 retention-days 一致
+ARTIFACT_MAX_AGE = timedelta(days=7)
+
+
+def queue(pkgbase, pkgver, directory=QUEUE_DIR):
+    path = Path(directory) / f'{pkgbase}.json'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'pkgbase': pkgbase, 'pkgver': pkgver, 'queued_at': int(time.time())}, f)
+        f.write('\n')
+
+
+def read_queue(paths):
+    """Yield the queued bumps of the given files and directories."""
+    for path in map(Path, paths):
+        for item in sorted(path.glob('*.json')) if path.is_dir() else [path]:
+            try:
+                with open(item) as f:
+                    yield json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                print(f"Failed to read the queued bump {item}.")
+
+
+def read_artifacts():
+    """Yield the queued bumps of the oldver-queue artifacts that have not expired yet."""
+    # push 任务只用到 queue，不需要安装这些依赖
+    import toml
+    from github import Github
+    from ledger import read_artifact
+
+    token = toml.load('config/keyfile.toml')['keys']['github.com']
+    repo = Github(token).get_repo('arch4edu/aur-auto-update')
+    since = datetime.now(timezone.utc) - ARTIFACT_MAX_AGE
+    # 列表按创建时间倒序返回
+    for artifact in repo.get_artifacts(ARTIFACT_NAME):
+        if artifact.created_at < since:
+            break
+        if artifact.expired:
+            continue
+        yield from read_artifact(artifact, token)
+
+
+def apply(bumps, index=None):
+    """Set the oldver of the queued packages; return the applied (pkgbase, pkgver, path) in order."""
+    index = index or ConfigIndex()
+    latest = {}
+    for bump in bumps:
+        pkgbase, pkgver = bump['pkgbase'], str(bump['pkgver'])
+        if pkgbase not in latest or vercmp(pkgver, latest[pkgbase]) > 0:
+            latest[pkgbase] = pkgver
+    applied = []
+    for pkgbase, pkgver in sorted(latest.items()):
+        package = index.get(pkgbase)
+        if package is None:
+            print(f"{pkgbase} is not configured any more.")
+            continue
+        oldver = package.get('oldver')
+        if oldver is not None and vercmp(pkgver, str(oldver)) <= 0:
+            continue
+        set_keys(package.path, {'oldver': pkgver})
+        applied.append((pkgbase, pkgver, package.path))
+        print(f"Updated the oldver of {pkgbase} to {pkgver}.")
+    return applied
+
+
+def commit(applied):
+    if len(applied) == 1:
+        pkgbase, pkgver, _ = applied[0]
+        message = f'{pkgbase}: auto updated to {pkgver}'
+    else:
+        message = f'Auto updated {len(applied)} packages\n\n'
+        message += '\n'.join(f'{pkgbase}: auto updated to {pkgver}' for pkgbase, pkgver, _ in applied)
+    subprocess.run(['git', 'add', '--'] + [str(path) for _, _, path in applied], check=True)
+    subprocess.run(['git', 'commit', '-q', '-m', message], check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the oldver of pushed packages back to their YAML files in batches.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    queue_parser = subparsers.add_parser('queue', help='queue the oldver bump of a pushed package')
+    queue_parser.add_argument('pkgbase')
+    queue_parser.add_argument('pkgver')
+    apply_parser = subparsers.add_parser('apply', help='apply the queued bumps')
+    apply_parser.add_argument('paths', nargs='*', help=f'queue files or directories (default: {QUEUE_DIR})')
+    apply_parser.add_argument('--artifacts', action='store_true', help='also apply the queues uploaded by recent workflow runs')
+    apply_parser.add_argument('--commit', action='store_true', help='commit all updated YAML files at once')
+    args = parser.parse_args()
+
+    if args.command == 'queue':
+        queue(args.pkgbase, args.pkgver)
+        return 0
+
+    bumps = list(read_queue(args.paths or [QUEUE_DIR]))
+    if args.artifacts:
+        try:
+            bumps.extend(read_artifacts())
+        except:
+            print(f"Failed to read the {ARTIFACT_NAME} artifacts.")
+            traceback.print_exc()
+    applied = apply(bumps)
+    print(f"Applied {len(applied)} of {len(bumps)} queued oldver bumps.")
+    if args.commit and applied:
+        commit(applied)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Pure-Python port of pacman's vercmp (libalpm/version.c).
+
+Usage:
+    vercmp.py <version1> <version2>
+    vercmp.py --check
+    vercmp.py --benchmark <count>
+
+Versions are compared like `vercmp` does: epoch first, then pkgver and, when
+both have one, pkgrel, each split into alternating numeric and alphabetic
+segments.  --check runs the recorded outputs of pacman's vercmp test suite
+(and compares with the `vercmp` binary when it is installed).
+"""
+
+import argparse
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+# 记录自 pacman 的 test/util/vercmptest.sh：(版本1, 版本2, vercmp 输出)
+VERCMP_CASES = [
+    # all similar length, no pkgrel
+    ('1.5.0', '1.5.0', 0),
+    ('1.5.1', '1.5.0', 1),
+    # mixed length
+    ('1.5.1', '1.5', 1),
+    # with pkgrel, simple
+    ('1.5.0-1', '1.5.0-1', 0),
+    ('1.5.0-1', '1.5.0-2', -1),
+    ('1.5.0-1', '1.5.1-1', -1),
+    ('1.5.0-2', '1.5.1-1', -1),
+    # with pkgrel, mixed lengths
+    ('1.5-1', '1.5.1-1', -1),
+    ('1.5-2', '1.5.1-1', -1),
+    ('1.5-2', '1.5.1-2', -1),
+    # mixed pkgrel inclusion
+    ('1.5', '1.5-1', 0),
+    ('1.5-1', '1.5', 0),
+    ('1.1-1', '1.1', 0),
+    ('1.0-1', '1.1', -1),
+    ('1.1-1', '1.0', 1),
+    # alphanumeric versions
+    ('1.5b-1', '1.5-1', -1),
+    ('1.5b', '1.5', -1),
+    ('1.5b-1', '1.5', -1),
+    ('1.5b', '1.5.1', -1),
+    # from the manpage
+    ('1.0a', '1.0alpha', -1),
+    ('1.0alpha', '1.0b', -1),
+    ('1.0b', '1.0beta', -1),
+    ('1.0beta', '1.0rc', -1),
+    ('1.0rc', '1.0', -1),
+    # going crazy? alpha-dotted versions
+    ('1.5.a', '1.5', 1),
+    ('1.5.b', '1.5.a', 1),
+    ('1.5.1', '1.5.b', 1),
+    # alpha dots and dashes
+    ('1.5.b-1', '1.5.b', 0),
+    ('1.5-1', '1.5.b', -1),
+    # same/similar content, differing separators
+    ('2.0', '2_0', 0),
+    ('2.0_a', '2_0.a', 0),
+    ('2.0a', '2.0.a', -1),
+    ('2___a', '2_a', 1),
+    # epoch included version comparisons
+    ('0:1.0', '0:1.0', 0),
+    ('0:1.0', '0:1.1', -1),
+    ('1:1.0', '0:1.0', 1),
+    ('1:1.0', '0:1.1', 1),
+    ('1:1.0', '2:1.1', -1),
+    # epoch + sometimes present pkgrel
+    ('1:1.0', '0:1.0-1', 1),
+    ('1:1.0-1', '0:1.1-1', 1),
+    # epoch included on one version
+    ('0:1.0', '1.0', 0),
+    ('0:1.0', '1.1', -1),
+    ('0:1.1', '1.0', 1),
+    ('1:1.0', '1.0', 1),
+    ('1:1.0', '1.1', 1),
+    ('1:1.1', '1.1', 1),
+]
+
+
+def _isdigit(c):
+    return '0' <= c <= '9'
+
+
+def _isalpha(c):
+    # pacman 在 C locale 下使用 isalpha/isdigit，只认 ASCII
+    return 'a' <= c <= 'z' or 'A' <= c <= 'Z'
+
+
+def _isalnum(c):
+    return _isdigit(c) or _isalpha(c)
+
+
+def rpmvercmp(a, b):
+    """Compare two version segments (no epoch or pkgrel) like libalpm's rpmvercmp."""
+    if a == b:
+        return 0
+    i = j = 0
+    len_a = len(a)
+    len_b = len(b)
+    while i < len_a and j < len_b:
+        start_a = i
+        start_b = j
+        while i < len_a and not _isalnum(a[i]):
+            i += 1
+        while j < len_b and not _isalnum(b[j]):
+            j += 1
+        if i >= len_a or j >= len_b:
+            break
+        # 分隔符长度不同时，分隔符更长的版本更新
+        if i - start_a != j - start_b:
+            return -1 if i - start_a < j - start_b else 1
+
+        end_a = i
+        end_b = j
+        if _isdigit(a[i]):
+            while end_a < len_a and _isdigit(a[end_a]):
+                end_a += 1
+            while end_b < len_b and _isdigit(b[end_b]):
+                end_b += 1
+            isnum = True
+        else:
+            while end_a < len_a and _isalpha(a[end_a]):
+                end_a += 1
+            while end_b < len_b and _isalpha(b[end_b]):
+                end_b += 1
+            isnum = False
+
+        # 两边的段类型不同时，数字段总是更新
+        if j == end_b:
+            return 1 if isnum else -1
+
+        one = a[i:end_a]
+        two = b[j:end_b]
+        if isnum:
+            one = one.lstrip('0')
+            two = two.lstrip('0')
+            if len(one) != len(two):
+                return 1 if len(one) > len(two) else -1
+        if one != two:
+            return -1 if one < two else 1
+        i = end_a
+        j = end_b
+
+    if i >= len_a and j >= len_b:
+        return 0
+    # 剩下的字母段不能比空串新：1.0rc < 1.0 < 1.0.1
+    rest_a = a[i:]
+    rest_b = b[j:]
+    if (not rest_a and not _isalpha(rest_b[0])) or (rest_a and _isalpha(rest_a[0])):
+        return -1
+    return 1
+
+
+def parse_evr(evr):
+    """Split a version into (epoch, pkgver, pkgrel); pkgrel is None when missing."""
+    digits = 0
+    while digits < len(evr) and _isdigit(evr[digits]):
+        digits += 1
+    rest = evr[digits:]
+    dash = rest.rfind('-')
+    release = None
+    if dash >= 0:
+        release = rest[dash + 1:]
+        rest = rest[:dash]
+        evr = evr[:digits] + rest
+    if rest.startswith(':'):
+        return evr[:digits] or '0', rest[1:], release
+    return '0', evr, release
+
+
+def vercmp(a, b):
+    """Return -1, 0 or 1 like `vercmp a b`."""
+    if a == b:
+        return 0
+    epoch_a, version_a, release_a = parse_evr(a)
+    epoch_b, version_b, release_b = parse_evr(b)
+    ret = rpmvercmp(epoch_a, epoch_b)
+    if ret == 0:
+        ret = rpmvercmp(version_a, version_b)
+        if ret == 0 and release_a is not None and release_b is not None:
+            ret = rpmvercmp(release_a, release_b)
+    return ret
+
+
+def check():
+    """Run the recorded cases in both directions, and against the vercmp binary if present."""
+    binary = shutil.which('vercmp')
+    failed = 0
+    for a, b, expected in VERCMP_CASES:
+        for x, y, want in [(a, b, expected), (b, a, -expected)]:
+            got = vercmp(x, y)
+            if binary is not None:
+                want = int(subprocess.run([binary, x, y], capture_output=True, text=True, check=True).stdout)
+            if got != want:
+                print(f"FAIL: vercmp {x} {y} = {got}, expected {want}")
+                failed += 1
+    source = 'the vercmp binary' if binary else 'the recorded outputs'
+    print(f"{len(VERCMP_CASES) * 2 - failed}/{len(VERCMP_CASES) * 2} comparisons agree with {source}.")
+    return 1 if failed else 0
+
+
+def random_version(rng):
+    parts = [str(rng.randint(0, 200)) for _ in range(rng.randint(1, 4))]
+    version = '.'.join(parts)
+    if rng.random() < 0.2:
+        version += rng.choice(['a', 'b', 'rc', 'alpha', 'beta', 'pre']) + str(rng.randint(0, 9))
+    if rng.random() < 0.1:
+        version = f'{rng.randint(1, 3)}:{version}'
+    if rng.random() < 0.5:
+        version += f'-{rng.randint(1, 5)}'
+    return version
+
+
+def benchmark(count):
+    rng = random.Random(0)
+    pairs = [(random_version(rng), random_version(rng)) for _ in range(count)]
+    start = time.perf_counter()
+    for a, b in pairs:
+        vercmp(a, b)
+    elapsed = time.perf_counter() - start
+    print(f"Compared {count} version pairs in {elapsed:.3f}s ({count / elapsed:,.0f} comparisons/s).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare package versions like pacman\'s vercmp.')
+    parser.add_argument('versions', nargs='*', metavar='version')
+    parser.add_argument('--check', action='store_true', help='run the recorded vercmp test cases')
+    parser.add_argument('--benchmark', type=int, metavar='COUNT', help='time COUNT random comparisons')
+    args = parser.parse_args()
+
+    if args.check:
+        return check()
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return 0
+    if len(args.versions) != 2:
+        parser.print_usage()
+        return 1
+    print(vercmp(*args.versions))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,19 @@
+"""Read and write nvchecker version files (oldver/newver)."""
+
+import json
+
+
+def read_verfile(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return data['data'] if data.get('version') == 2 else data
+
+
+def write_verfile(path, versions):
+    data = {'version': 2, 'data': dict(sorted(versions.items()))}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.write('\n')
@@ -0,0 +1,40 @@
+"""
+Update top-level keys of the package YAML files in place.
+
+Only the lines of the changed keys are touched, so comments, key order and
+formatting of the rest of the file are kept, like bin/update-yaml does.
+"""
+
+import json
+import re
+
+import yaml
+
+
+def format_scalar(value):
+    """Format a value so that YAML reads it back as the same value; versions stay strings."""
+    if not isinstance(value, str):
+        return json.dumps(value)
+    try:
+        if yaml.safe_load(value) == value and '\n' not in value:
+            return value
+    except yaml.YAMLError:
+        pass
+    return "'" + value.replace("'", "''") + "'"
+
+
+def set_keys(path, values):
+    """Set top-level `key: value` lines of a YAML file, appending missing keys."""
+    with open(path) as f:
+        lines = f.read().splitlines()
+    for key, value in values.items():
+        line = f'{key}: {format_scalar(value)}'
+        key_re = re.compile(rf'^{re.escape(key)}:(\s|$)')
+        for i, old in enumerate(lines):
+            if key_re.match(old):
+                lines[i] = line
+                break
+        else:
+            lines.append(line)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')